@@ -6,11 +6,11 @@ src_path = "src/wt_tools/"
 packages = ["multiprocessing"]
 includes = []
 excludes = ["unittest", "pydoc", "construct.examples", "bz2", "lib2to3", "test", "tkinter"]
-includefiles = [os.path.join(src_path, "./formats/blk.lark"), os.path.join(src_path, '../../README.md')]
+includefiles = [os.path.join(src_path, '../../README.md')]
 zip_include_packages = ["collections", "construct", "ctypes", "encodings", "json", "logging", "importlib", "formats",
                         "zstandard", "xml", "urllib", "distutils", "click", "pkg_resources", "colorama", "bencodepy",
                         "jsondiff", "requests", "chardet", "idna", "urllib3", "email", "http", "certifi", "multiprocessing",
-                        "multiprocessing-logging", "lark", "blk"]
+                        "multiprocessing-logging", "blk"]
 
 
 blk_unpack = Executable(
@@ -33,6 +33,10 @@ ddsx_unpack = Executable(
     script=os.path.join(src_path, "ddsx_unpack.py"),
 )
 
+ddsx_index = Executable(
+    script=os.path.join(src_path, "ddsx_index.py"),
+)
+
 dxp_unpack = Executable(
     script=os.path.join(src_path, "dxp_unpack.py"),
 )
@@ -41,6 +45,10 @@ vromfs_unpacker = Executable(
     script=os.path.join(src_path, "vromfs_unpacker.py"),
 )
 
+vromfs_blk_unpacker = Executable(
+    script=os.path.join(src_path, "vromfs_blk_unpacker.py"),
+)
+
 wrpl_unpacker = Executable(
     script=os.path.join(src_path, "wrpl_unpacker.py"),
 )
@@ -70,7 +78,7 @@ setup(
                            "packages": packages, "zip_include_packages": zip_include_packages,
                            "path": sys.path + [src_path]}},
     executables=[blk_unpack, blk_unpack_ng, blk_unpack_ng_mp,
-                 clog_unpack, ddsx_unpack, dxp_unpack, vromfs_unpacker,
+                 clog_unpack, ddsx_unpack, ddsx_index, dxp_unpack, vromfs_unpacker, vromfs_blk_unpacker,
                  wrpl_unpacker, wrpl_unpacker_ng,
                  blk_minify, update_differ, update_checker]
 )
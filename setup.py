@@ -7,5 +7,4 @@ setup(
     url='https://github.com/klensy/wt-tools',
     package_dir={'': 'src'},
     packages=find_packages(where='src'),
-    package_data={'wt_tools': ['formats/blk.lark']},
 )
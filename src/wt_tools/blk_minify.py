@@ -1,13 +1,13 @@
 import argparse
+import glob
+import multiprocessing as mp
 import os.path
-from typing import AnyStr, Dict
-
-from lark import Lark
-
-try:
-    from formats.common import blk_transformer, get_tool_path
-except ImportError:
-    from wt_tools.formats.common import blk_transformer, get_tool_path
+import re
+import struct
+import sys
+import time
+from collections.abc import Mapping
+from typing import AnyStr, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
 
 strip_options = {
     'strip_empty_objects': False,
@@ -15,19 +15,374 @@ strip_options = {
     'strip_disabled_objects': False
 }
 
+# output types of blk unpackers: minified text of Section, as is or with all strip options
+MIN_BLK = 'min_blk'
+MIN_BLK_STRIPPED = 'min_blk_stripped'
+
+# whitespace, separators and comments between statements
+_skip_re = re.compile(r'(?:[\s;]+|//[^\n]*|/\*.*?\*/)*', re.DOTALL)
+# whitespace and comments between tokens of a statement
+_space_re = re.compile(r'(?:\s+|//[^\n]*|/\*.*?\*/)*', re.DOTALL)
+_name_re = re.compile(r'[\w\-.][\w\-./]*|"[^"\n]+"')
+_type_re = re.compile(r':\s*(\w+)\s*=\s*')
+# not quoted value: numbers, booleans, matrix, ends with the line
+_value_re = re.compile(r'[^;}\n/]*')
+_value_space_re = re.compile(r'\s+')
+
+
+class MinifyError(ValueError):
+    pass
+
+
+def _error(data: str, pos: int, msg: str) -> MinifyError:
+    line = data.count('\n', 0, pos) + 1
+    column = pos - data.rfind('\n', 0, pos)
+    return MinifyError("{} at line {}, column {}".format(msg, line, column))
+
+
+def _scan_value(blk_data: str, pos: int) -> Tuple[str, int]:
+    """Value starting at pos, minified, and its end."""
+
+    quote = blk_data[pos:pos + 1]
+    if quote in ('"', "'"):
+        end = blk_data.find(quote, pos + 1) + 1
+        if not end:
+            raise _error(blk_data, pos, "Unterminated string")
+        return blk_data[pos:end], end
+
+    end = _value_re.match(blk_data, pos).end()
+    value = _value_space_re.sub('', blk_data[pos:end])
+    if not value:
+        raise _error(blk_data, pos, "Expected value")
+    return value, end
+
+
+class _Output:
+    """
+    Objects are written only when something is written into them, so empty, comment and disabled objects are dropped
+    without buffering their content, memory is bounded by the nesting depth.
+    """
+
+    def __init__(self, strip_empty: bool):
+        self.strip_empty = strip_empty
+        self.names: List[str] = []  # names of open not stripped objects
+        self.opened = 0  # number of objects written from the start of names
+        self.separate = False  # value at the top level is written, ';' is needed before the next statement
+
+    def _statement(self) -> Iterator[str]:
+        if self.opened < len(self.names):
+            if not self.opened and self.separate:
+                self.separate = False
+                yield ';'
+            yield '{'.join(self.names[self.opened:]) + '{'
+            self.opened = len(self.names)
+        elif not self.names and self.separate:
+            self.separate = False
+            yield ';'
+
+    def value(self, name: str, type_: str, value: str) -> Iterator[str]:
+        yield from self._statement()
+        if self.names:
+            yield '{}:{}={};'.format(name, type_, value)
+        else:
+            yield '{}:{}={}'.format(name, type_, value)
+            self.separate = True
+
+    def open(self, name: str):
+        self.names.append(name)
+
+    def close(self) -> Iterator[str]:
+        if self.opened == len(self.names):
+            self.names.pop()
+            self.opened -= 1
+            yield '}'
+        else:
+            name = self.names.pop()
+            if not self.strip_empty:
+                yield from self._statement()
+                yield name + '{}'
+
+
+def iterminify(blk_data: str, minify_options: Dict[AnyStr, bool]) -> Iterator[str]:
+    """
+    Minified text of blk in one pass over the text, without building a tree.
+    Values end with ';', but the last one of the file.
+
+    :param blk_data: text of blk
+    :param minify_options: strip_options
+    :return parts of minified text
+    """
+
+    strip_comment = minify_options.get('strip_comment_objects', False)
+    # disabled objects starts with __ in mission editor:  __unitRespawn{
+    strip_disabled = minify_options.get('strip_disabled_objects', False)
+    output = _Output(minify_options.get('strip_empty_objects', False))
+    skipped = 0  # depth in stripped object
+
+    pos = _skip_re.match(blk_data).end()
+    while pos < len(blk_data):
+        if blk_data[pos] == '}':
+            if skipped:
+                skipped -= 1
+            elif output.names:
+                yield from output.close()
+            else:
+                raise _error(blk_data, pos, "Unexpected '}'")
+            pos = _skip_re.match(blk_data, pos + 1).end()
+            continue
+
+        m = _name_re.match(blk_data, pos)
+        if not m:
+            raise _error(blk_data, pos, "Expected name")
+        name = m.group()
+        pos = _space_re.match(blk_data, m.end()).end()
+
+        if blk_data.startswith('{', pos):
+            if skipped or (strip_comment and name == 'comment') or (strip_disabled and name.startswith('__')):
+                skipped += 1
+            else:
+                output.open(name)
+            pos = _skip_re.match(blk_data, pos + 1).end()
+            continue
+
+        m = _type_re.match(blk_data, pos)
+        if not m:
+            raise _error(blk_data, pos, "Expected ':type=' or '{'")
+        value, pos = _scan_value(blk_data, m.end())
+        pos = _skip_re.match(blk_data, pos).end()
+        if not skipped:
+            yield from output.value(name, m.group(1), value)
+
+    if output.names or skipped:
+        raise _error(blk_data, pos, "Expected '}'")
+
 
 def minify(blk_data: AnyStr, minify_options: Dict[AnyStr, bool]) -> AnyStr:
-    grammar_path = 'blk.lark'
-    blk_parser = Lark(open(os.path.join(get_tool_path(), grammar_path)).read(), parser='lalr',
-                      transformer=blk_transformer(minify_options), keep_all_tokens=True)
+    return ''.join(iterminify(blk_data, minify_options))
+
+
+def min_options(out_type: str) -> Dict[AnyStr, bool]:
+    """strip_options for MIN_BLK or MIN_BLK_STRIPPED."""
+
+    return {option: out_type == MIN_BLK_STRIPPED for option in strip_options}
+
+
+# blk value types by class name of blk.types
+_type_tags = {
+    'Bool': 'b',
+    'Str': 't',
+    'Int': 'i',
+    'Long': 'i64',
+    'Float': 'r',
+    'Float2': 'p2',
+    'Float3': 'p3',
+    'Float4': 'p4',
+    'Int2': 'ip2',
+    'Int3': 'ip3',
+    'Color': 'c',
+    'Float12': 'm',
+}
+_float_struct = struct.Struct('<f')
+
+
+def _format_float(value) -> str:
+    """Shortest text of float, which is read back to the same float32."""
+
+    value = float(value)
+    packed = _float_struct.pack(value)
+    for precision in range(1, 10):
+        text = '{:.{}g}'.format(value, precision)
+        if _float_struct.pack(float(text)) == packed:
+            return text
+    return repr(value)
+
+
+def _components(value) -> Iterator:
+    for component in value:
+        if isinstance(component, (tuple, list)):
+            yield from _components(component)
+        else:
+            yield component
+
+
+def _format_value(value) -> Tuple[str, str]:
+    """Type and minified text of blk value."""
+
+    for cls in type(value).__mro__:
+        type_ = _type_tags.get(cls.__name__)
+        if type_:
+            break
+    else:
+        raise MinifyError("Unknown value type: {}".format(type(value).__name__))
+
+    if type_ == 'b':
+        return type_, 'yes' if value else 'no'
+    if type_ == 't':
+        text = str(value)
+        quote = "'" if '"' in text else '"'
+        if quote in text:
+            # strings are not escaped, the text would not be read back
+            raise MinifyError("String with both quotes: {!r}".format(text))
+        return type_, quote + text + quote
+    if type_ == 'r':
+        return type_, _format_float(value)
+    if type_ in ('i', 'i64'):
+        return type_, str(int(value))
+    if type_ == 'm':
+        components = [_format_float(c) for c in _components(value)]
+        return type_, '[' + ''.join('[' + ','.join(components[i:i + 3]) + ']'
+                                    for i in range(0, len(components), 3)) + ']'
+    if type_.startswith('p'):
+        return type_, ','.join(_format_float(c) for c in _components(value))
+    return type_, ','.join(str(int(c)) for c in _components(value))
 
-    return blk_parser.parse(blk_data)
+
+def _format_name(name: str) -> str:
+    return name if _name_re.fullmatch(name) else '"{}"'.format(name)
+
+
+def iterminify_section(root: Mapping, minify_options: Dict[AnyStr, bool]) -> Iterator[str]:
+    """
+    Minified text of decoded blk Section, as minify writes it for the text of the Section.
+    The strip options are applied while walking the tree.
+
+    :param root: Section from blk.binary.compose_fat_data or compose_slim_data
+    :param minify_options: strip_options
+    :return parts of minified text
+    """
+
+    strip_comment = minify_options.get('strip_comment_objects', False)
+    strip_disabled = minify_options.get('strip_disabled_objects', False)
+    output = _Output(minify_options.get('strip_empty_objects', False))
+
+    def walk(section: Mapping) -> Iterator[str]:
+        for name, values in section.items():
+            for value in values if isinstance(values, list) else (values,):
+                if isinstance(value, Mapping):
+                    if (strip_comment and name == 'comment') or (strip_disabled and name.startswith('__')):
+                        continue
+                    output.open(_format_name(name))
+                    yield from walk(value)  # @r
+                    yield from output.close()
+                else:
+                    yield from output.value(_format_name(name), *_format_value(value))
+
+    return walk(root)
+
+
+def serialize(root: Mapping, ostream: TextIO, minify_options: Dict[AnyStr, bool]):
+    """Write minified text of decoded blk Section, without pretty text in between."""
+
+    for part in iterminify_section(root, minify_options):
+        ostream.write(part)
+
+
+def min_path(filename: str) -> str:
+    f_path, f_ext = os.path.splitext(filename)
+    return f_path + '.min' + f_ext
+
+
+def _glob_base(pattern: str) -> str:
+    """Directory part of the pattern before the first wildcard."""
+
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep)[:-1]:
+        if any(c in part for c in '*?['):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+
+def find_blk_files(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    Files to minify: files as is, *.blk files of directories, but already minified *.min.blk ones, and glob patterns.
+
+    :return (path, path relative to its input) pairs, largest first
+    """
+
+    found = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames:
+                    if filename.endswith('.blk') and not filename.endswith('.min.blk'):
+                        file_path = os.path.join(dirpath, filename)
+                        found.setdefault(file_path, os.path.relpath(file_path, path))
+        elif os.path.isfile(path):
+            found.setdefault(path, os.path.basename(path))
+        else:
+            base = _glob_base(path)
+            for file_path in glob.iglob(path, recursive=True):
+                if os.path.isfile(file_path):
+                    found.setdefault(file_path, os.path.relpath(file_path, base))
+    return sorted(found.items(), key=lambda item: os.path.getsize(item[0]), reverse=True)
+
+
+def minify_file(filename: str, out_filename: str, minify_options: Dict[AnyStr, bool]) -> Tuple[int, int]:
+    """
+    :return sizes of the file and the minified file
+    """
+
+    # get size, as we get it wrong from text opened file
+    parsed_file_size = os.path.getsize(filename)
+    out_dir = os.path.dirname(out_filename)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(filename, mode='r', encoding="utf8") as f:
+        data = f.read()
+    try:
+        with open(out_filename, 'w', encoding="utf8") as f:
+            for part in iterminify(data, minify_options):
+                f.write(part)
+    except MinifyError:
+        os.remove(out_filename)
+        raise
+    return parsed_file_size, os.path.getsize(out_filename)
+
+
+def _minify_file_task(task: Tuple[str, str, Dict[AnyStr, bool]]) -> Tuple[str, int, int, Optional[str]]:
+    filename, out_filename, minify_options = task
+    try:
+        return (filename, *minify_file(filename, out_filename, minify_options), None)
+    except (MinifyError, OSError, UnicodeDecodeError) as e:
+        return filename, 0, 0, '{}: {}'.format(type(e).__name__, e)
+
+
+def minify_files(files: Sequence[Tuple[str, str]], minify_options: Dict[AnyStr, bool],
+                 jobs: int = 1) -> Tuple[int, int, List[Tuple[str, str]]]:
+    """
+    :param files: (path, output path) pairs
+    :param jobs: number of processes
+    :return total size of minified files and of their output, (path, error message) for failed files
+    """
+
+    tasks = [(filename, out_filename, minify_options) for filename, out_filename in files]
+    if jobs > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        with mp.Pool(jobs) as pool:
+            results = list(pool.imap_unordered(_minify_file_task, tasks, chunksize))
+    else:
+        results = [_minify_file_task(task) for task in tasks]
+
+    size = out_size = 0
+    errors = []
+    for filename, file_size, out_file_size, error in results:
+        if error:
+            errors.append((filename, error))
+        else:
+            size += file_size
+            out_size += out_file_size
+    return size, out_size, sorted(errors)
 
 
 def main():
     parser = argparse.ArgumentParser(description="minify blk")
-    parser.add_argument('filename', help="blk file")
-    parser.add_argument("-O", dest='out_filename', default=False, nargs='?', help="output file")
+    parser.add_argument('filenames', nargs='+', metavar='filename',
+                        help="blk file, directory with blk files or glob pattern, like missions/**/*.blk")
+    parser.add_argument("-O", dest='out_filename', default=False, nargs='?',
+                        help="output file for one file, output directory with the same tree for several files, "
+                             "by default files are written next to the original ones with .min.blk suffix")
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help="number of processes")
     # removes not all empty objects, really
     parser.add_argument('--strip_empty_objects', dest='strip_empty_objects', action="store_true",
                         default=False, help="remove empty objects")
@@ -40,15 +395,6 @@ def main():
                         default=False, help="select all options")
     parse_result = parser.parse_args()
 
-    filename = parse_result.filename
-
-    out_filename = ''
-    if parse_result.out_filename:
-        out_filename = parse_result.out_filename
-    else:
-        f_path, f_ext = os.path.splitext(filename)
-        out_filename = f_path + '.min' + f_ext
-
     if parse_result.strip_all:
         for option in strip_options:
             strip_options[option] = True
@@ -62,25 +408,33 @@ def main():
     if parse_result.strip_disabled_objects:
         strip_options['strip_disabled_objects'] = True
 
-    if not os.path.exists(filename):
-        print("File", filename, "not exist")
-        return
-    # get size, as we get it wrong from text opened file
-    parsed_file_size = os.path.getsize(filename)
-    if parsed_file_size == 0:
-        with open(out_filename, 'wb') as f:
-            pass
-        return
-    with open(filename, mode='r', encoding="utf8") as f:
-        data = f.read()
+    found = find_blk_files(parse_result.filenames)
+    if not found:
+        print("No files found:", *parse_result.filenames)
+        sys.exit(1)
+
+    single_file = len(parse_result.filenames) == 1 and os.path.isfile(parse_result.filenames[0])
+    out_path = parse_result.out_filename
+    if single_file and out_path:
+        files = [(found[0][0], out_path)]
+    elif out_path:
+        files = [(filename, os.path.join(out_path, rel_path)) for filename, rel_path in found]
+    else:
+        files = [(filename, min_path(filename)) for filename, _ in found]
+
+    start = time.perf_counter()
+    size, out_size, errors = minify_files(files, strip_options, max(1, parse_result.jobs))
+    elapsed = time.perf_counter() - start
 
-    parsed_data = minify(data, strip_options)
-    with open(out_filename, 'w', encoding="utf8") as f:
-        f.write(parsed_data)
-    print("minified {} from {} to {}, with rate {:.2}".format(filename,
-                                                              parsed_file_size, len(parsed_data),
-                                                              len(parsed_data) / parsed_file_size))
+    for filename, error in errors:
+        print("Can't minify", filename, error)
+    print("minified {} of {} files from {} to {}, with rate {:.2}, {:.1f} MiB/s".format(
+        len(files) - len(errors), len(files), size, out_size, out_size / size if size else 1.0,
+        size / 2**20 / elapsed if elapsed else 0.0))
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
+    mp.freeze_support()
     main()
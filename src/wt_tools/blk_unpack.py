@@ -1,19 +1,20 @@
-import json
+from json.encoder import encode_basestring
+import multiprocessing as mp
 import os.path
 import re
 import struct
-import uuid
+import sys
 import zlib
 from collections import OrderedDict
-from typing import Tuple, List, Iterable, Any, Dict, MutableMapping
+from operator import itemgetter
+from typing import Tuple, List, Iterable, Iterator, Any, Dict, MutableMapping, Optional
 
 import click
-from lark import Lark, LarkError
 
 try:
-    from formats.common import get_tool_path
+    from formats.sniff import is_text
 except ImportError:
-    from wt_tools.formats.common import get_tool_path
+    from wt_tools.formats.sniff import is_text
 
 type_list = {
     0x0: 'size', 0x1: 'str', 0x2: 'int', 0x3: 'float', 0x4: 'vec2f',
@@ -32,7 +33,42 @@ type_list_strict_blk = {
 
 quotless_variable_name = re.compile(r"^[\w\.\-]+$")
 
-blk_parser = None
+
+def _first(value: tuple):
+    return value[0]
+
+
+def _m4x3f(value: tuple) -> List[List[float]]:
+    return [list(value[i:i + 3]) for i in range(0, 12, 3)]
+
+
+# value decoders by type code: struct, offset of value from the block id, offset of the next block id,
+# conversion of the unpacked tuple or None to keep it
+_value_decoders: List[Optional[Tuple[struct.Struct, int, int, Any]]] = [None] * 0x100
+for _type, _fmt, _value_offset, _next_offset, _convert in (
+        (0x0, 'HH', 0x4, 0x8, None),  # size: [xxyy], xx - flat size, yy - group num
+        (0x1, 'I', 0x4, 0x8, _first),  # str
+        (0x2, 'i', 0x4, 0x8, _first),  # int
+        (0x3, 'f', 0x4, 0x8, _first),  # float
+        (0x4, 'ff', 0x4, 0xc, None),  # vec2f
+        (0x5, 'fff', 0x4, 0x10, list),  # vec3f
+        (0x6, 'ffff', 0x4, 0x14, None),  # vec4f
+        (0x7, 'II', 0x4, 0xc, None),  # vec2i
+        (0x8, 'III', 0x4, 0x10, None),  # vec3i
+        (0x9, 'B', 0x2, 0x4, _first),  # bool
+        (0xa, 'I', 0x4, 0x8, _first),  # color code, like #6120f00
+        (0xb, '12f', 0x4, 0x34, _m4x3f),  # m4x3f: 4 vec3f
+        (0xc, 'II', 0x4, 0xc, None),  # time: unixtime
+        (0x10, 'I', 0x4, 0x8, _first),  # typex7: what type?
+        (0x89, 'B', 0x2, 0x4, _first),  # typex: reversed 'bool'
+):
+    _value_decoders[_type] = struct.Struct(_fmt), _value_offset, _next_offset, _convert
+
+# bool values are kept in the block id
+_inline_types = frozenset((0x9, 0x89))
+
+# block id, inline value, block type
+block_id_struct = struct.Struct('HBB')
 
 
 class WrongFiletypeError(RuntimeError):
@@ -50,9 +86,10 @@ class NotPackedBLKError(RuntimeError):
     def __init__(self, arg):
         self.param = arg
 
-# https://stackoverflow.com/questions/13249415
-# using private interface
+
 class NoIndent(object):
+    """Value written on one line in the indented json output."""
+
     def __init__(self, value):
         self.value = value
 
@@ -60,26 +97,119 @@ class NoIndent(object):
         return repr(self.value)
 
 
-class NoIndentEncoder(json.JSONEncoder):
-    def __init__(self, *args, **kwargs):
-        super(NoIndentEncoder, self).__init__(*args, **kwargs)
-        self.kwargs = dict(kwargs)
-        del self.kwargs['indent']
-        self._replacement_map = {}
+_INFINITY = float('inf')
 
-    def default(self, o):
-        if isinstance(o, NoIndent):
-            key = uuid.uuid4().hex
-            self._replacement_map[key] = json.dumps(o.value, **self.kwargs)
-            return "@@%s@@" % (key,)
-        else:
-            return super(NoIndentEncoder, self).default(o)
 
-    def encode(self, o):
-        result = super(NoIndentEncoder, self).encode(o)
-        for k, v in self._replacement_map.items():
-            result = result.replace('"@@%s@@"' % (k,), v)
-        return result
+def _encode_float(o: float) -> str:
+    if o != o:
+        return 'NaN'
+    elif o == _INFINITY:
+        return 'Infinity'
+    elif o == -_INFINITY:
+        return '-Infinity'
+    return float.__repr__(o)
+
+
+class NoIndentEncoder:
+    """
+    Streaming json encoder: NoIndent values are written in place on one line.
+
+    The text is the same as json.dumps(o, ensure_ascii=False, indent=indent, separators=separators, sort_keys=sort_keys)
+    with NoIndent values replaced by json.dumps(value, ensure_ascii=False, separators=separators, sort_keys=sort_keys).
+    """
+
+    def __init__(self, indent: Optional[int] = None, separators: Tuple[str, str] = (', ', ': '),
+                 sort_keys: bool = False):
+        self.indent = ' ' * indent if indent is not None else None
+        self.item_separator, self.key_separator = separators
+        self.sort_keys = sort_keys
+
+    def encode(self, o) -> str:
+        return ''.join(self.iterencode(o))
+
+    def iterencode(self, o) -> Iterator[str]:
+        return self._iterencode(o, 0, self.indent)
+
+    def _encode_scalar(self, o) -> Optional[str]:
+        if isinstance(o, str):
+            return encode_basestring(o)
+        elif o is None:
+            return 'null'
+        elif o is True:
+            return 'true'
+        elif o is False:
+            return 'false'
+        elif isinstance(o, int):
+            return int.__repr__(o)
+        elif isinstance(o, float):
+            return _encode_float(o)
+        return None
+
+    def _iterencode(self, o, level: int, indent: Optional[str]) -> Iterator[str]:
+        chunk = self._encode_scalar(o)
+        if chunk is not None:
+            yield chunk
+        elif isinstance(o, (list, tuple)):
+            yield from self._iterencode_list(o, level, indent)
+        elif isinstance(o, dict):
+            yield from self._iterencode_dict(o, level, indent)
+        elif isinstance(o, NoIndent):
+            yield ''.join(self._iterencode(o.value, 0, None))
+        else:
+            raise TypeError(f'Object of type {o.__class__.__name__} is not JSON serializable')
+
+    def _iterencode_list(self, xs, level: int, indent: Optional[str]) -> Iterator[str]:
+        if not xs:
+            yield '[]'
+            return
+        if indent is not None:
+            level += 1
+            newline_indent = '\n' + indent * level
+            separator = self.item_separator + newline_indent
+            yield '[' + newline_indent
+        else:
+            separator = self.item_separator
+            yield '['
+        first = True
+        for x in xs:
+            if first:
+                first = False
+            else:
+                yield separator
+            yield from self._iterencode(x, level, indent)
+        if indent is not None:
+            yield '\n' + indent * (level - 1)
+        yield ']'
+
+    def _iterencode_dict(self, m, level: int, indent: Optional[str]) -> Iterator[str]:
+        if not m:
+            yield '{}'
+            return
+        if indent is not None:
+            level += 1
+            newline_indent = '\n' + indent * level
+            separator = self.item_separator + newline_indent
+            yield '{' + newline_indent
+        else:
+            separator = self.item_separator
+            yield '{'
+        items = sorted(m.items(), key=itemgetter(0)) if self.sort_keys else m.items()
+        first = True
+        for key, value in items:
+            if not isinstance(key, str):
+                if isinstance(key, (float, int, bool)) or key is None:
+                    key = self._encode_scalar(key)
+                else:
+                    raise TypeError(f'keys must be str, int, float, bool or None, not {key.__class__.__name__}')
+            if first:
+                first = False
+            else:
+                yield separator
+            yield encode_basestring(key) + self.key_separator
+            yield from self._iterencode(value, level, indent)
+        if indent is not None:
+            yield '\n' + indent * (level - 1)
+        yield '}'
 
 
 def transform_mapping(m: MutableMapping):
@@ -114,6 +244,14 @@ class BLK:
         self.blk_version = 0  # 2 for 1.45 and lower, 3 for 1.47
 
     def unpack(self, out_type=output_type['json'], is_sorted=False) -> str:
+        return ''.join(self.iterunpack(out_type, is_sorted))
+
+    def iterunpack(self, out_type=output_type['json'], is_sorted=False) -> Iterator[str]:
+        """
+        Parse blk and return an iterator over chunks of the output text.
+        Parsing errors are raised here, chunks are encoded while they are written.
+        """
+
         # check file header and version
         # TODO: error handle
         # is_sorted - sort output by keys in json output only
@@ -139,20 +277,16 @@ class BLK:
             raise TypeError('Unknown version %d' % self.blk_version)
 
         if self.output_type == BLK.output_type['json']:
-            return json.dumps(unpacked_data, ensure_ascii=False, cls=NoIndentEncoder, indent=2, separators=(',', ': '),
-                              sort_keys=is_sorted)
+            return NoIndentEncoder(indent=2, separators=(',', ': '), sort_keys=is_sorted).iterencode(unpacked_data)
         elif self.output_type == BLK.output_type['json_min']:
-            return json.dumps(unpacked_data, ensure_ascii=False, cls=NoIndentEncoder, separators=(',', ':'),
-                              sort_keys=is_sorted)
+            return NoIndentEncoder(separators=(',', ':'), sort_keys=is_sorted).iterencode(unpacked_data)
         elif self.output_type == BLK.output_type['strict_blk']:
-            return self.print_strict_blk(unpacked_data)
+            return iter((self.print_strict_blk(unpacked_data),))
         elif self.output_type == BLK.output_type['json_2']:
-            return json.dumps(unpacked_data, ensure_ascii=False, cls=NoIndentEncoder, indent=2, separators=(',', ': '),
-                              sort_keys=is_sorted)
+            return NoIndentEncoder(indent=2, separators=(',', ': '), sort_keys=is_sorted).iterencode(unpacked_data)
         elif self.output_type == BLK.output_type['json_3']:
             transform_mapping(unpacked_data)
-            return json.dumps(unpacked_data, ensure_ascii=False, cls=NoIndentEncoder, indent=2, separators=(',', ': '),
-                              sort_keys=is_sorted)
+            return NoIndentEncoder(indent=2, separators=(',', ': '), sort_keys=is_sorted).iterencode(unpacked_data)
         else:
             print("error out type: %s" % self.output_type)
             exit(1)
@@ -365,29 +499,25 @@ class BLK:
         while cur_p < len(self.data):
             flat_num, group_num = b_size
             if flat_num > 0:
-                id_list: List[Tuple] = []
-                for i in range(flat_num):
-                    b_id, b_type = self.get_block_id_w_type(cur_p)
-                    b_value, b_off = self.get_block_value(cur_p, b_type)
-                    id_list.append((b_id, b_type, b_value))
-                    cur_p += 4
-                # print id_list
-                # print 'cur_p start 2th cycle: %d' % cur_p
-                for b_id, b_type, b_value in id_list:
-                    if type_list[b_type] == 'bool' or type_list[b_type] == 'typex':
-                        str_id, str_val = self.from_id_to_str(b_id, b_type, b_value, sub_units_names)
-                        curr_block, not_list = self.parse_inner_detect_take(not_list,
-                                                                            str_id, b_type,
-                                                                            str_val, curr_block)
+                # block ids of the flat params go first, then their values
+                id_list_end = cur_p + flat_num * block_id_struct.size
+                id_list = list(block_id_struct.iter_unpack(self.data[cur_p:id_list_end]))
+                for i, (b_id, b_inline_value, b_type) in enumerate(id_list):
+                    if _value_decoders[b_type] is None:
+                        raise TypeError("Unknown type = {:x}, position = {:x}".format(
+                            b_type, cur_p + i * block_id_struct.size))
+                cur_p = id_list_end
+                for b_id, b_inline_value, b_type in id_list:
+                    if b_type in _inline_types:
+                        b_value = b_inline_value
                     else:
-                        # - 0x4 in next line b'couse of stupid func, need fix it
+                        # - 0x4: values are read as if they follow the block id
                         b_value, b_off = self.get_block_value(cur_p - 0x4, b_type)
-                        str_id, str_val = self.from_id_to_str(b_id, b_type, b_value, sub_units_names)
-                        curr_block, not_list = self.parse_inner_detect_take(not_list,
-                                                                            str_id, b_type,
-                                                                            str_val, curr_block)
-                        # and there
                         cur_p += b_off - 0x4
+                    str_id, str_val = self.from_id_to_str(b_id, b_type, b_value, sub_units_names)
+                    curr_block, not_list = self.parse_inner_detect_take(not_list,
+                                                                        str_id, b_type,
+                                                                        str_val, curr_block)
                 b_size = (0, group_num)
             else:  # flat_num == 0
                 b_id, b_type = self.get_block_id_w_type(cur_p)
@@ -436,7 +566,7 @@ class BLK:
 
     # return block id with type
     def get_block_id_w_type(self, offset: int) -> Tuple[int, int]:
-        block_id, block_type = struct.unpack_from('HxB', self.data, offset)
+        block_id, _, block_type = block_id_struct.unpack_from(self.data, offset)
         return block_id, block_type
 
     def from_id_to_str(self, id: int, type: int, value, sub_units_names) -> Tuple[str, Any]:
@@ -450,44 +580,14 @@ class BLK:
 
     # return value, next offset
     def get_block_value(self, id_offset: int, block_type: int) -> Tuple[Any, int]:
-        if block_type not in type_list:
+        decoder = _value_decoders[block_type]
+        if decoder is None:
             raise TypeError("Unknown type = {:x}, position = {:x}".format(block_type, id_offset))
-        block_type_from_list = type_list[block_type]
-        if block_type_from_list == 'str':
-            value, offset = struct.unpack_from('I', self.data, id_offset + 0x4)[0], 0x8
-        elif block_type_from_list == 'int':
-            value, offset = struct.unpack_from('i', self.data, id_offset + 0x4)[0], 0x8
-        elif block_type_from_list == 'float':
-            value, offset = struct.unpack_from('f', self.data, id_offset + 0x4)[0], 0x8
-        elif block_type_from_list == 'typex':  # reversed 'bool'
-            value, offset = struct.unpack_from('B', self.data, id_offset + 0x2)[0], 0x4
-        elif block_type_from_list == 'bool':
-            value, offset = struct.unpack_from('B', self.data, id_offset + 0x2)[0], 0x4
-        elif block_type_from_list == 'size':  # [xxyy], xx - flat size, yy - group num
-            value, offset = struct.unpack_from('HH', self.data, id_offset + 0x4), 0x8
-        elif block_type_from_list == 'vec2f':
-            value, offset = struct.unpack_from('ff', self.data, id_offset + 0x4), 0xc
-        elif block_type_from_list == 'vec3f':
-            value, offset = list(struct.unpack_from('fff', self.data, id_offset + 0x4)), 0x10
-        elif block_type_from_list == 'vec2i':
-            value, offset = struct.unpack_from('II', self.data, id_offset + 0x4), 0xc
-        elif block_type_from_list == 'time':  # unixtime
-            value, offset = struct.unpack_from('II', self.data, id_offset + 0x4), 0xc
-        elif block_type_from_list == 'vec4f':
-            value, offset = struct.unpack_from('ffff', self.data, id_offset + 0x4), 0x14
-        elif block_type_from_list == 'm4x3f':
-            ret = [self.get_block_value(id_offset, 0x5)[0],
-                   self.get_block_value(id_offset + 0xc, 0x5)[0],
-                   self.get_block_value(id_offset + 0x18, 0x5)[0],
-                   self.get_block_value(id_offset + 0x24, 0x5)[0]]
-            value, offset = ret, 0x34
-        elif block_type_from_list == 'color':  # color code, like #6120f00
-            value, offset = struct.unpack_from('I', self.data, id_offset + 0x4)[0], 0x8
-        elif block_type_from_list == 'typex7':  # what type?
-            value, offset = struct.unpack_from('I', self.data, id_offset + 0x4)[0], 0x8
-        elif block_type_from_list == 'vec3i':  # what type?
-            value, offset = struct.unpack_from('III', self.data, id_offset + 0x4), 0x10
-        return value, offset
+        value_struct, value_offset, next_offset, convert = decoder
+        value = value_struct.unpack_from(self.data, id_offset + value_offset)
+        if convert is not None:
+            value = convert(value)
+        return value, next_offset
 
     def print_item(self, item_type: str, item_data, sub_units_names):
         if item_type == 'str':
@@ -581,7 +681,14 @@ class BLK:
         return key_hash
 
 
-def unpack_file(filename: os.PathLike, out_type: int, is_sorted: bool):
+def _unpack_file(filename: os.PathLike, out_type: int, is_sorted: bool):
+    """
+    Unpack blk file into blkx file next to it.
+
+    :raise WrongFiletypeError: if file is neither packed nor text blk
+    :raise TypeError: if packed blk is broken
+    """
+
     with open(filename, 'rb') as f:
         binary_data = f.read()
 
@@ -589,52 +696,83 @@ def unpack_file(filename: os.PathLike, out_type: int, is_sorted: bool):
     out_filename = os.path.join(out_filename + ext + 'x')
     # don't delete empty blks
     if len(binary_data) == 0:
-        print('    ', 'Empty file')
         with open(out_filename, 'wb') as f:
             pass
         return
     blk = BLK(binary_data)
-    # TODO: fix this exception block, its ugly
-    decoded_data = None
     try:
-        decoded_data = blk.unpack(out_type, is_sorted)
-    except NotPackedBLKError as e:
-        global blk_parser
-        if not blk_parser:
-            grammar_path = 'blk.lark'
-            blk_parser = Lark(open(os.path.join(get_tool_path(), grammar_path)).read(), parser='lalr')
-        try:
-            # reread file as text and parse it, maybe it already in blk format
-            with open(filename, 'r', newline='') as f:
-                text_data = f.read()
-            blk_parser.parse(text_data)
-            decoded_data = text_data
-        except LarkError as e2:
+        decoded_data = blk.iterunpack(out_type, is_sorted)
+    except NotPackedBLKError:
+        # maybe it already in blk format
+        if not is_text(binary_data):
             raise WrongFiletypeError("Unknown file type")
-    except WrongFiletypeError as e:
-        print('    ', e)
-    except TypeError as e:
-        print('    ', e)
-    if decoded_data:
+        # reread file as text
+        with open(filename, 'r', newline='') as f:
+            decoded_data = (f.read(),)
+    try:
         with open(out_filename, 'w', newline='', encoding='utf-8') as f:
-            f.write(decoded_data)
+            f.writelines(decoded_data)
+    # json output is encoded while it is written
+    except TypeError:
+        os.remove(out_filename)
+        raise
 
 
-def unpack_dir(dirname: os.PathLike, out_type: int, is_sorted: bool):
-    """
-    Unpack all *.blk files in `dirname` with `out_type` format.
-    """
+def unpack_file(filename: os.PathLike, out_type: int, is_sorted: bool):
+    try:
+        _unpack_file(filename, out_type, is_sorted)
+    except (WrongFiletypeError, TypeError) as e:
+        print('    ', e)
+
+
+def _unpack_file_task(args: Tuple[str, int, bool]) -> Tuple[str, Optional[str]]:
+    filename = args[0]
+    try:
+        _unpack_file(*args)
+    except Exception as e:
+        return filename, '{}: {}'.format(type(e).__name__, e)
+    return filename, None
+
+
+def find_blk_files(dirname: os.PathLike) -> List[str]:
+    """Paths of *.blk files in `dirname`, largest first."""
+
+    paths = []
     for root, dirs, files in os.walk(dirname):
         for filename in files:
             subname = os.path.join(root, filename)
-            if os.path.isfile(subname) and os.path.splitext(subname)[1] == '.blk':
-                print(subname)
-                try:
-                    unpack_file(subname, out_type, is_sorted)
-                except Exception as e:
-                    import sys
-                    from traceback import print_exc
-                    print_exc(file=sys.stdout)
+            if os.path.splitext(subname)[1] == '.blk' and os.path.isfile(subname):
+                paths.append(subname)
+    paths.sort(key=os.path.getsize, reverse=True)
+    return paths
+
+
+def unpack_dir(dirname: os.PathLike, out_type: int, is_sorted: bool, jobs: int = 1) -> List[Tuple[str, str]]:
+    """
+    Unpack all *.blk files in `dirname` with `out_type` format.
+
+    :param jobs: number of processes
+    :return (path, error message) for files that have not been unpacked
+    """
+
+    tasks = [(filename, out_type, is_sorted) for filename in find_blk_files(dirname)]
+    if jobs > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        with mp.Pool(jobs) as pool:
+            results = pool.imap_unordered(_unpack_file_task, tasks, chunksize)
+            errors = _collect_errors(results)
+    else:
+        errors = _collect_errors(map(_unpack_file_task, tasks))
+    return errors
+
+
+def _collect_errors(results: Iterable[Tuple[str, Optional[str]]]) -> List[Tuple[str, str]]:
+    errors = []
+    for filename, error in results:
+        print(filename)
+        if error:
+            errors.append((filename, error))
+    return errors
 
 
 @click.command()
@@ -642,7 +780,8 @@ def unpack_dir(dirname: os.PathLike, out_type: int, is_sorted: bool):
 @click.option('--format', 'out_format', type=click.Choice(['json', 'json_min', 'strict_blk', 'json_2', 'json_3'],
     case_sensitive=False), default='json', show_default=True)
 @click.option('--sort', 'is_sorted', is_flag=True, default=False)
-def main(path: os.PathLike, out_format: str, is_sorted: bool):
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1), default=1, show_default=True)
+def main(path: os.PathLike, out_format: str, is_sorted: bool, jobs: int):
     """
     blk_unpack: Unpacks blk files to human readable version
 
@@ -655,6 +794,8 @@ def main(path: os.PathLike, out_format: str, is_sorted: bool):
 
     sort: sort keys in json output, should be more easy to see diff
 
+    jobs: number of processes to unpack a directory with, largest files go first
+
     examples: `blk_unpack some.blk` will unpack to `some.blkx` using json format (default). If you want to get file to
     use it in game, use 'blk_unpack --format=strict_blk some.blk'. You can also unpack a folder with blk files:
     `blk_unpack some_folder`.
@@ -675,8 +816,14 @@ def main(path: os.PathLike, out_format: str, is_sorted: bool):
     if os.path.isfile(path):
         unpack_file(path, out_type, is_sorted)
     else:
-        unpack_dir(path, out_type, is_sorted)
+        errors = unpack_dir(path, out_type, is_sorted, jobs)
+        for filename, error in errors:
+            print("[FAIL] {}: {}".format(filename, error), file=sys.stderr)
+        if errors:
+            print("[FAIL] {} files have not been unpacked".format(len(errors)), file=sys.stderr)
+            sys.exit(1)
 
 
 if __name__ == '__main__':
+    mp.freeze_support()
     main()
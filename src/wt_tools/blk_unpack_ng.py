@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 from pathlib import Path
@@ -6,8 +7,12 @@ import typing as t
 import click
 try:
     import blk_unpack as bbf3
+    import blk_minify
+    from formats.sniff import is_text
 except ImportError:
     import wt_tools.blk_unpack as bbf3
+    import wt_tools.blk_minify as blk_minify
+    from wt_tools.formats.sniff import is_text
 import blk.binary as bin
 from blk.binary.constructor import Name
 import blk.text as txt
@@ -22,33 +27,63 @@ def serialize_text(root, ostream, out_type, is_sorted):
         txt.serialize(root, ostream, dialect=txt.StrictDialect)
     elif out_type in (jsn.JSON, jsn.JSON_2, jsn.JSON_3):
         jsn.serialize(root, ostream, out_type, is_sorted)
+    elif out_type in (blk_minify.MIN_BLK, blk_minify.MIN_BLK_STRIPPED):
+        blk_minify.serialize(root, ostream, blk_minify.min_options(out_type))
 
 
-def is_text(bs: t.Iterable[bytes]) -> bool:
-    restricted = bytes.fromhex('00 01 02 03 04 05 06 07 08 0b 0c 0e 0f 10 11 12 14 13 15 16 17 18 19')
-    return not any(b in restricted for b in bs)
+def unpack_bbf(bs: bytes, out_type) -> str:
+    # файл прежнего формата минимизируется по тексту
+    if out_type in (blk_minify.MIN_BLK, blk_minify.MIN_BLK_STRIPPED):
+        ss = bbf3.BLK(bs).unpack(bbf3.BLK.output_type['strict_blk'], is_sorted=False)
+        return blk_minify.minify(ss, blk_minify.min_options(out_type))
+    return bbf3.BLK(bs).unpack(out_type, is_sorted=False)
 
 
 def create_text(path: os.PathLike) -> t.TextIO:
     return open(path, 'w', newline='', encoding='utf8')
 
 
-def names_path(file_path: Path, nm: str) -> t.Optional[Path]:
-    file_path = file_path.absolute()
-    root_path = Path(file_path.drive + os.path.sep)
+# директория => ближайший nm в ней или выше
+_nm_paths: t.Dict[t.Tuple[Path, str], t.Optional[Path]] = {}
+# nm => (mtime, таблица имен)
+_names_cache: t.Dict[Path, t.Tuple[int, t.Sequence[Name]]] = {}
+
+
+def dir_names_path(dir_path: Path, nm: str) -> t.Optional[Path]:
+    """Nearest nm file in the directory or its parents, the result is kept for every directory on the way."""
+
+    key = dir_path, nm
+    try:
+        return _nm_paths[key]
+    except KeyError:
+        pass
 
-    dir_path = file_path.parent
     nm_path = dir_path / nm
-    if nm_path.is_file():
-        return nm_path
+    if not nm_path.is_file():
+        parent = dir_path.parent
+        nm_path = None if parent == dir_path else dir_names_path(parent, nm)
+    _nm_paths[key] = nm_path
+    return nm_path
+
+
+def names_path(file_path: Path, nm: str) -> t.Optional[Path]:
+    return dir_names_path(file_path.absolute().parent, nm)
+
 
-    while dir_path != root_path:
-        dir_path = dir_path.parent
-        nm_path = dir_path / nm
-        if nm_path.is_file():
-            return nm_path
+def load_names(nm_path: Path) -> t.Sequence[Name]:
+    """NameMap from nm file, decoded once until the file is modified."""
 
-    return None
+    nm_path = nm_path.resolve()
+    mtime = nm_path.stat().st_mtime_ns
+    cached = _names_cache.get(nm_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    print(f'Loading NameMap from {nm_path}')
+    with open(nm_path, 'rb') as nm_istream:
+        names = bin.compose_names_data(nm_istream)
+    _names_cache[nm_path] = mtime, names
+    return names
 
 
 def process_file(file_path: Path, names: t.Optional[t.Sequence], out_type: int, is_sorted: bool):
@@ -69,8 +104,7 @@ def process_file(file_path: Path, names: t.Optional[t.Sequence], out_type: int,
             elif bs in (b'\x00BBF', b'\x00BBz'):
                 istream.seek(0)
                 bs = istream.read()
-                bbf3_parser = bbf3.BLK(bs)
-                ss = bbf3_parser.unpack(out_type, is_sorted=False)
+                ss = unpack_bbf(bs, out_type)
                 with create_text(out_path) as ostream:
                     ostream.write(ss)
             # файл с именами в nm
@@ -78,9 +112,7 @@ def process_file(file_path: Path, names: t.Optional[t.Sequence], out_type: int,
                 if names is None:
                     nm_path = names_path(file_path, 'nm')
                     if nm_path:
-                        print(f'Loading NameMap from {nm_path}')
-                        with open(nm_path, 'rb') as nm_istream:
-                            names = bin.compose_names_data(nm_istream)
+                        names = load_names(nm_path)
                 if names:
                     istream.seek(0)
                     root = bin.compose_slim_data(names, istream)
@@ -91,22 +123,22 @@ def process_file(file_path: Path, names: t.Optional[t.Sequence], out_type: int,
             # файл с именами внутри или текст
             else:
                 istream.seek(0)
-                try:
-                    root = bin.compose_fat_data(istream)
-                    with create_text(out_path) as ostream:
-                        serialize_text(root, ostream, out_type, is_sorted)
-                except bin.ComposeError:  # текст
-                    # рабочей грамматики у меня пока нет
-                    # есть парсер текста на parsy, но без строк в тройных кавычках и вложенных комментариев
-                    # поэтому, считаю, что текст корректный
-                    # выполняется только простая проверка на мелкие значения
-                    istream.seek(0)
-                    bs = istream.read()
-                    if is_text(bs):
-                        print(f'{INDENT}Copied as is')
-                        out_path.write_bytes(bs)
-                    else:
+                bs = istream.read()
+                # рабочей грамматики у меня пока нет
+                # есть парсер текста на parsy, но без строк в тройных кавычках и вложенных комментариев
+                # поэтому, считаю, что текст корректный
+                # выполняется только простая проверка на мелкие значения, до разбора
+                if is_text(bs):
+                    print(f'{INDENT}Copied as is')
+                    out_path.write_bytes(bs)
+                else:
+                    try:
+                        root = bin.compose_fat_data(io.BytesIO(bs))
+                    except bin.ComposeError:
                         print(f'{INDENT}Unknown file format')
+                    else:
+                        with create_text(out_path) as ostream:
+                            serialize_text(root, ostream, out_type, is_sorted)
 
     except (TypeError, EnvironmentError, bin.ComposeError) as e:
         print(f'{INDENT}{e}')
@@ -119,10 +151,7 @@ def process_dir(dir_path: Path, out_type: int, is_sorted: bool):
     for path in paths:
         if path.is_file() and path.name == 'nm':
             try:
-                print(f'Loading NameMap from {path}')
-                with open(path, 'rb') as nm_istream:
-                    names = bin.compose_names_data(nm_istream)
-
+                names = load_names(path)
                 process_slim_dir(dir_path, names, out_type, is_sorted)
                 return
             except bin.ComposeError as e:
@@ -148,7 +177,8 @@ def process_slim_dir(dir_path: Path, names: t.Sequence[Name], out_type: int, is_
 @click.command()
 @click.argument('path', type=click.Path(exists=True))
 @click.option('--format', 'out_format',
-              type=click.Choice(['strict_blk', 'json', 'json_2', 'json_3'], case_sensitive=False), default='json',
+              type=click.Choice(['strict_blk', 'json', 'json_2', 'json_3', 'min_blk', 'min_blk_stripped'],
+                                case_sensitive=False), default='json',
               show_default=True)
 @click.option('--sort', 'is_sorted', is_flag=True, default=False)
 def main(path: str, out_format: str, is_sorted: bool):
@@ -157,6 +187,8 @@ def main(path: str, out_format: str, is_sorted: bool):
         'json': jsn.JSON,
         'json_2': jsn.JSON_2,
         'json_3': jsn.JSON_3,
+        'min_blk': blk_minify.MIN_BLK,
+        'min_blk_stripped': blk_minify.MIN_BLK_STRIPPED,
     }[out_format]
 
     path = Path(path)
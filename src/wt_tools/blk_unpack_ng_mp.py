@@ -1,16 +1,21 @@
+import io
 import os
 import sys
 from pathlib import Path
 import logging
 import multiprocessing as mp
+import time
 import typing as t
-from functools import partial
 import click
 from multiprocessing_logging import install_mp_handler
 try:
-    import blk_unpack as bbf3
+    import blk_minify
+    from blk_unpack_ng import create_text, dir_names_path, serialize_text, unpack_bbf
+    from formats.sniff import is_text
 except ImportError:
-    import wt_tools.blk_unpack as bbf3
+    import wt_tools.blk_minify as blk_minify
+    from wt_tools.blk_unpack_ng import create_text, dir_names_path, serialize_text, unpack_bbf
+    from wt_tools.formats.sniff import is_text
 import blk.binary as bin
 import blk.text as txt
 import blk.json as jsn
@@ -21,43 +26,15 @@ install_mp_handler()
 INDENT = ' '*4
 
 
-def serialize_text(root, ostream, out_type, is_sorted):
-    if out_type == txt.STRICT_BLK:
-        txt.serialize(root, ostream, dialect=txt.StrictDialect)
-    elif out_type in (jsn.JSON, jsn.JSON_2, jsn.JSON_3):
-        jsn.serialize(root, ostream, out_type, is_sorted)
+def process_file(file_path: Path, names: t.Optional[t.Sequence], out_type: int, is_sorted: bool) -> t.Optional[str]:
+    """
+    Write .blkx next to .blk file.
 
+    :return error message if the file has not been unpacked
+    """
 
-def is_text(bs: bytes) -> bool:
-    restricted = bytes.fromhex('00 01 02 03 04 05 06 07 08 0b 0c 0e 0f 10 11 12 14 13 15 16 17 18 19')
-    return not any(b in restricted for b in bs)
-
-
-def create_text(path: os.PathLike) -> t.TextIO:
-    return open(path, 'w', newline='', encoding='utf8')
-
-
-def names_path(file_path: Path, nm: str) -> t.Optional[Path]:
-    file_path = file_path.absolute()
-    root_path = Path(file_path.drive + os.path.sep)
-
-    dir_path = file_path.parent
-    nm_path = dir_path / nm
-    if nm_path.is_file():
-        return nm_path
-
-    while dir_path != root_path:
-        dir_path = dir_path.parent
-        nm_path = dir_path / nm
-        if nm_path.is_file():
-            return nm_path
-
-    return None
-
-
-def process_file(file_path: Path, names: t.Optional[t.Sequence], out_type: int, is_sorted: bool):
     if not file_path.suffix == '.blk':
-        return
+        return None
 
     out_path = file_path.with_suffix('.blkx')
     logging.info(file_path)
@@ -73,18 +50,15 @@ def process_file(file_path: Path, names: t.Optional[t.Sequence], out_type: int,
             elif bs in (b'\x00BBF', b'\x00BBz'):
                 istream.seek(0)
                 bs = istream.read()
-                bbf3_parser = bbf3.BLK(bs)
-                ss = bbf3_parser.unpack(out_type, is_sorted=False)
+                ss = unpack_bbf(bs, out_type)
                 with create_text(out_path) as ostream:
                     ostream.write(ss)
             # файл с именами в nm
             elif not bs[0]:
                 if names is None:
-                    nm_path = names_path(file_path, 'nm')
+                    nm_path = dir_names_path(file_path.absolute().parent, 'nm')
                     if nm_path:
-                        logging.info(f'Loading NameMap from {nm_path}')
-                        with open(nm_path, 'rb') as nm_istream:
-                            names = bin.compose_names_data(nm_istream)
+                        names = worker_names(nm_path)
                 if names:
                     istream.seek(0)
                     root = bin.compose_slim_data(names, istream)
@@ -92,102 +66,157 @@ def process_file(file_path: Path, names: t.Optional[t.Sequence], out_type: int,
                         serialize_text(root, ostream, out_type, is_sorted)
                 else:  # не найдена таблица имен
                     logging.error(f"{INDENT}NameMap not found")
+                    return "NameMap not found"
             # файл с именами внутри или текст
             else:
                 istream.seek(0)
-                try:
-                    root = bin.compose_fat_data(istream)
-                    with create_text(out_path) as ostream:
-                        serialize_text(root, ostream, out_type, is_sorted)
-                except bin.ComposeError:  # текст
-                    # рабочей грамматики у меня пока нет
-                    # есть парсер текста на parsy, но без строк в тройных кавычках и вложенных комментариев
-                    # поэтому, считаю, что текст корректный
-                    # выполняется только простая проверка на мелкие значения
-                    istream.seek(0)
-                    bs = istream.read()
-                    if is_text(bs):
-                        logging.info(f'{INDENT}Copied as is')
-                        out_path.write_bytes(bs)
-                    else:
+                bs = istream.read()
+                # рабочей грамматики у меня пока нет
+                # есть парсер текста на parsy, но без строк в тройных кавычках и вложенных комментариев
+                # поэтому, считаю, что текст корректный
+                # выполняется только простая проверка на мелкие значения, до разбора
+                if is_text(bs):
+                    logging.info(f'{INDENT}Copied as is')
+                    out_path.write_bytes(bs)
+                else:
+                    try:
+                        root = bin.compose_fat_data(io.BytesIO(bs))
+                    except bin.ComposeError:
                         logging.info(f'{INDENT}Unknown file format')
+                        return "Unknown file format"
+                    else:
+                        with create_text(out_path) as ostream:
+                            serialize_text(root, ostream, out_type, is_sorted)
 
     except (TypeError, EnvironmentError, bin.ComposeError) as e:
         logging.exception(f'{INDENT}{e}', exc_info=True)
+        return f'{type(e).__name__}: {e}'
 
+    return None
 
-def process_dir(dir_path: Path, out_type: int, is_sorted: bool, pool: mp.Pool):
-    # Директории без общих имен обрабатываются пулом процессов из аргументов.
-    # Для каждой корневой директории с общими именами создается новый пул процессов, которым обрабатываются все дочерние
-    # директории.
-
-    paths = tuple(dir_path.iterdir())
-
-    for path in paths:
-        if path.is_file() and path.name == 'nm':
-            try:
-                logging.info(f'Loading NameMap from {path}')
-                with open(path, 'rb') as nm_istream:
-                    names = bin.compose_names_data(nm_istream)
 
-                with mp.Pool(None) as pool:
-                    file_paths = file_paths_r(dir_path)
-                    process_file_ = partial(process_file, names=names, out_type=out_type, is_sorted=is_sorted)
-                    pool.map_async(process_file_, file_paths)
-                    pool.close()
-                    pool.join()
-                return
-            except bin.ComposeError as e:
-                logging.error(f'{path}')
-                logging.exception(f'{INDENT}{e}', exc_info=True)
-                return
+# таблицы имен процесса, каждая загружается один раз при первом использовании, ошибка тоже запоминается
+_names: t.Dict[Path, t.Union[t.Sequence, bin.ComposeError]] = {}
 
-    dir_paths = []
-    file_paths = []
 
-    for path in paths:
-        if path.is_dir():
-            dir_paths.append(path)
-        elif path.is_file():
-            file_paths.append(path)
+def worker_names(nm_path: Path) -> t.Sequence:
+    names = _names.get(nm_path)
+    if names is None:
+        logging.info(f'Loading NameMap from {nm_path}')
+        try:
+            with open(nm_path, 'rb') as nm_istream:
+                names = bin.compose_names_data(nm_istream)
+        except bin.ComposeError as e:
+            names = e
+        _names[nm_path] = names
+    if isinstance(names, bin.ComposeError):
+        raise names
+    return names
 
-    for dir_path in dir_paths:
-        process_dir(dir_path, out_type, is_sorted, pool)
 
-    process_file_ = partial(process_file, names=None, out_type=out_type, is_sorted=is_sorted)
-    pool.map_async(process_file_, file_paths)
+class Task(t.NamedTuple):
+    file_path: Path
+    nm_path: t.Optional[Path]
+    out_type: int
+    is_sorted: bool
 
 
-def file_paths_r(dir_path: Path) -> t.Generator[Path, None, None]:
-    for path in dir_path.iterdir():
-        if path.is_dir():
-            yield from file_paths_r(path)  # @r
-        elif path.is_file():
-            yield path
+def _process_task(task: Task) -> t.Tuple[Path, t.Optional[str]]:
+    try:
+        names = worker_names(task.nm_path) if task.nm_path else None
+    except (EnvironmentError, bin.ComposeError) as e:
+        return task.file_path, f'NameMap {task.nm_path}: {type(e).__name__}: {e}'
+    return task.file_path, process_file(task.file_path, names, task.out_type, task.is_sorted)
+
+
+def collect_tasks(dir_path: Path, out_type: int, is_sorted: bool) -> t.List[Task]:
+    """
+    Flat list of .blk files in the directory, largest first.
+    Every file gets the nearest nm of its directory or its parents, the names are decoded by workers only.
+    """
+
+    tasks = []
+    for root, dirs, files in os.walk(dir_path):
+        root_path = Path(root)
+        nm_path = dir_names_path(root_path.absolute(), 'nm')
+        for name in files:
+            path = root_path / name
+            if path.suffix == '.blk':
+                tasks.append((path.stat().st_size, Task(path, nm_path, out_type, is_sorted)))
+
+    tasks.sort(key=lambda size_task: size_task[0], reverse=True)
+    return [task for _, task in tasks]
+
+
+def files_rate(start: float, bar) -> t.Callable[[t.Any], str]:
+    def show(_) -> str:
+        elapsed = time.perf_counter() - start
+        return f'{bar.pos / elapsed:.0f} files/s' if elapsed > 0 else ''
+    return show
+
+
+def process_dir(dir_path: Path, out_type: int, is_sorted: bool, jobs: t.Optional[int] = None,
+                progress: bool = False) -> t.Tuple[int, t.List[t.Tuple[Path, str]]]:
+    """
+    Unpack all .blk files in the directory with one pool of processes.
+
+    :param jobs: number of processes, by default number of CPUs
+    :param progress: show files/s progress on stderr
+    :return number of files, (path, error message) for files that have not been unpacked
+    """
+
+    errors = []
+    tasks = collect_tasks(dir_path, out_type, is_sorted)
+    jobs = jobs or os.cpu_count() or 1
+    # около 16 кусков на процесс: крупные файлы идут первыми, куски мелких в конце выравнивают загрузку процессов
+    chunksize = max(1, len(tasks) // (jobs * 16))
+
+    with mp.Pool(jobs) as pool:
+        results = pool.imap_unordered(_process_task, tasks, chunksize)
+        if progress:
+            start = time.perf_counter()
+            with click.progressbar(results, length=len(tasks), label='Unpacking', file=sys.stderr) as bar:
+                bar.item_show_func = files_rate(start, bar)
+                errors.extend((path, error) for path, error in bar if error)
+        else:
+            errors.extend((path, error) for path, error in results if error)
+
+    return len(tasks), errors
 
 
 @click.command()
 @click.argument('path', type=click.Path(exists=True))
 @click.option('--format', 'out_format',
-              type=click.Choice(['strict_blk', 'json', 'json_2', 'json_3'], case_sensitive=False),
+              type=click.Choice(['strict_blk', 'json', 'json_2', 'json_3', 'min_blk', 'min_blk_stripped'],
+                                case_sensitive=False),
               default='json', show_default=True)
 @click.option('--sort', 'is_sorted', is_flag=True, default=False)
-def main(path: str, out_format: str, is_sorted: bool):
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1), default=None)
+@click.option('--progress', 'progress', is_flag=True, default=False)
+def main(path: str, out_format: str, is_sorted: bool, jobs: t.Optional[int], progress: bool):
     out_type = {
         'strict_blk': txt.STRICT_BLK,
         'json': jsn.JSON,
         'json_2': jsn.JSON_2,
         'json_3': jsn.JSON_3,
+        'min_blk': blk_minify.MIN_BLK,
+        'min_blk_stripped': blk_minify.MIN_BLK_STRIPPED,
     }[out_format]
 
     path = Path(path)
+    start = time.perf_counter()
     if path.is_file():
-        process_file(path, None, out_type, is_sorted)
+        error = process_file(path, None, out_type, is_sorted)
+        files_count, errors = 1, [(path, error)] if error else []
     else:
-        with mp.Pool(None) as pool:
-            process_dir(path, out_type, is_sorted, pool)
-            pool.close()
-            pool.join()
+        files_count, errors = process_dir(path, out_type, is_sorted, jobs, progress)
+    elapsed = time.perf_counter() - start
+
+    for file_path, error in sorted(errors):
+        print(f'[FAIL] {file_path}: {error}', file=sys.stderr)
+    print(f"[{'FAIL' if errors else 'OK'}] {path}: {files_count - len(errors)} of {files_count} files in {elapsed:.1f} s")
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,265 @@
+"""
+Index of ddsx textures: format, size, mip levels and codec, read from 0x20 byte headers only.
+
+Textures are found in .ddsx files, in .dxp.bin packs, which keep headers of all their textures in one table, and in
+.vromfs.bin images, as .ddsx and .dxp.bin entries. Texture data of .ddsx and .dxp.bin files is never read or unpacked.
+
+Packed .vromfs.bin images are the exception: their body, with texture data inside, is decompressed up to the last
+texture entry, or whole for a cold index cache record, so they are scanned at the speed of decompression.
+"""
+
+import csv
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import typing as t
+import click
+try:
+    from formats.ddsx_parser import compression_type, ddsx_header_struct
+    from formats.sniff import sniff, DDSX, DXP, VROMFS
+    from formats.vromfs_image import VromfsImage, VromfsImageError, IndexCache
+    from vromfs_unpacker import normalize_name
+except ImportError:
+    from wt_tools.formats.ddsx_parser import compression_type, ddsx_header_struct
+    from wt_tools.formats.sniff import sniff, DDSX, DXP, VROMFS
+    from wt_tools.formats.vromfs_image import VromfsImage, VromfsImageError, IndexCache
+    from wt_tools.vromfs_unpacker import normalize_name
+
+Path = t.Union[str, os.PathLike]
+Buffer = t.Union[bytes, memoryview, mmap.mmap]
+
+DDSX_HEADER_SIZE = ddsx_header_struct.size
+# dxp_unpack offsets
+DXP_FILES_COUNT_OFFSET = 0x8
+DXP_FILE_NAMES_OFFSET = 0x48
+DXP_DDS_BLOCK_OFFSET_FROM = 0x20
+COMPRESSION_MASK = 0xe0
+
+CSV = 'csv'
+JSONL = 'jsonl'
+SQLITE = 'sqlite'
+
+
+class DdsxIndexError(Exception):
+    pass
+
+
+class TextureRecord(t.NamedTuple):
+    source: str  # path of .ddsx, .dxp.bin or .vromfs.bin file
+    name: str  # texture path inside the source, empty for .ddsx file
+    format: str
+    width: int
+    height: int
+    depth: int
+    levels: int
+    codec: str
+    mem_size: int
+    packed_size: int
+    flags: int
+
+
+def parse_header(source: str, name: str, header: Buffer) -> TextureRecord:
+    if len(header) < DDSX_HEADER_SIZE:
+        raise DdsxIndexError("Truncated header" + (': ' + name if name else ''))
+    label, d3d_format, flags, w, h, levels, _, depth, _, _, mem_size, packed_size = \
+        ddsx_header_struct.unpack_from(header)
+    if label != b'DDSx':
+        raise DdsxIndexError("Not a ddsx header" + (': ' + name if name else ''))
+    codec = compression_type.get((flags >> 24) & COMPRESSION_MASK, 'unknown')
+    return TextureRecord(source, name, d3d_format.rstrip(b'\x00').decode('latin-1'), w, h, depth, levels, codec,
+                         mem_size, packed_size, flags)
+
+
+def _read_names(buf: Buffer, offset: int, count: int) -> t.List[str]:
+    """count zero terminated names starting at offset, read by chunks."""
+
+    names = []
+    tail = b''
+    while len(names) < count:
+        chunk = bytes(buf[offset:offset + 0x1000])
+        if not chunk:
+            raise DdsxIndexError("Truncated names table")
+        offset += len(chunk)
+        parts = (tail + chunk).split(b'\x00')
+        tail = parts.pop()
+        names.extend(parts)
+    return [name.decode('utf8') for name in names[:count]]
+
+
+def scan_dxp(source: str, buf: Buffer, prefix: str = '') -> t.Iterator[TextureRecord]:
+    """Headers of dxp textures from its table of headers, texture data is not touched."""
+
+    if bytes(buf[:4]) != b'DxP2':
+        raise DdsxIndexError("Wrong dxp type")
+    count = struct.unpack_from('H', buf, DXP_FILES_COUNT_OFFSET)[0]
+    names = _read_names(buf, DXP_FILE_NAMES_OFFSET, count)
+    offset = struct.unpack_from('I', buf, DXP_DDS_BLOCK_OFFSET_FROM)[0] + 0x10
+    for i, name in enumerate(names):
+        header = buf[offset + i * DDSX_HEADER_SIZE:offset + (i + 1) * DDSX_HEADER_SIZE]
+        yield parse_header(source, prefix + name.split('*')[0] + '.ddsx', header)
+
+
+def scan_ddsx_file(path: str) -> t.Iterator[TextureRecord]:
+    with open(path, 'rb') as f:
+        header = f.read(DDSX_HEADER_SIZE)
+    yield parse_header(path, '', header)
+
+
+def scan_dxp_file(path: str) -> t.Iterator[TextureRecord]:
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from scan_dxp(path, mm)
+
+
+def scan_vromfs_file(path: str, index_cache: t.Optional[Path] = None) -> t.Iterator[TextureRecord]:
+    """
+    .ddsx and .dxp.bin entries of the image, a packed body is unpacked only up to the last of them.
+    With a cold or stale index cache record the whole body is unpacked and hashed first, see IndexCache.
+    """
+
+    with VromfsImage(path, IndexCache(index_cache) if index_cache else None) as image:
+        for entry in image:
+            name = normalize_name(entry.filename)
+            if name.endswith('.ddsx'):
+                yield parse_header(path, name, entry.data[:DDSX_HEADER_SIZE])
+            elif name.endswith('.dxp.bin'):
+                yield from scan_dxp(path, entry.data, name + '/')
+
+
+def _file_type(path: str) -> t.Optional[str]:
+    name = os.path.basename(path)
+    if name.endswith('.ddsx'):
+        return DDSX
+    elif name.endswith('.dxp.bin'):
+        return DXP
+    elif name.endswith('.vromfs.bin'):
+        return VROMFS
+    return None
+
+
+def find_sources(paths: t.Iterable[str]) -> t.Iterator[t.Tuple[str, str]]:
+    """
+    (path, type) of files to scan: files are sniffed by their magic, files in directories are chosen by suffix.
+    """
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    type_ = _file_type(filename)
+                    if type_:
+                        yield os.path.join(root, filename), type_
+        else:
+            with open(path, 'rb') as f:
+                yield path, sniff(f.read(4))
+
+
+def scan(paths: t.Iterable[str], errors: t.List[t.Tuple[str, str]],
+         index_cache: t.Optional[Path] = None) -> t.Iterator[TextureRecord]:
+    """
+    Records of all textures in files and directories.
+
+    :param errors: (path, error message) for files that can not be scanned are appended here
+    :param index_cache: path to directory of decoded vromfs tables, see IndexCache
+    """
+
+    for path, type_ in find_sources(paths):
+        try:
+            if type_ == DDSX:
+                yield from scan_ddsx_file(path)
+            elif type_ == DXP:
+                yield from scan_dxp_file(path)
+            elif type_ == VROMFS:
+                yield from scan_vromfs_file(path, index_cache)
+            else:
+                raise DdsxIndexError("Not a ddsx, dxp or vromfs file")
+        except (DdsxIndexError, VromfsImageError, OSError, ValueError, struct.error) as e:
+            errors.append((path, '{}: {}'.format(type(e).__name__, e)))
+
+
+def write_csv(records: t.Iterable[TextureRecord], ostream: t.TextIO) -> int:
+    writer = csv.writer(ostream)
+    writer.writerow(TextureRecord._fields)
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
+
+
+def write_jsonl(records: t.Iterable[TextureRecord], ostream: t.TextIO) -> int:
+    count = 0
+    for record in records:
+        ostream.write(json.dumps(record._asdict(), ensure_ascii=False))
+        ostream.write('\n')
+        count += 1
+    return count
+
+
+def write_sqlite(records: t.Iterable[TextureRecord], db_path: Path, batch_size: int = 1000) -> int:
+    """Records into textures table, the table is created anew."""
+
+    columns = ', '.join(TextureRecord._fields)
+    placeholders = ', '.join('?' * len(TextureRecord._fields))
+    count = 0
+    with sqlite3.connect(os.fspath(db_path)) as db:
+        db.execute('DROP TABLE IF EXISTS textures')
+        db.execute('CREATE TABLE textures ({})'.format(columns))
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                db.executemany('INSERT INTO textures VALUES ({})'.format(placeholders), batch)
+                count += len(batch)
+                batch.clear()
+        db.executemany('INSERT INTO textures VALUES ({})'.format(placeholders), batch)
+        count += len(batch)
+    db.close()
+    return count
+
+
+@click.command()
+@click.argument('paths', metavar='PATH...', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('-o', '--output', 'output_path', type=click.Path(dir_okay=False), default=None)
+@click.option('--format', 'out_format', type=click.Choice([CSV, JSONL, SQLITE]), default=CSV, show_default=True)
+@click.option('--index_cache', 'index_cache', type=click.Path(file_okay=False), default=None,
+              envvar='WT_TOOLS_INDEX_CACHE')
+def main(paths: t.Sequence[str], output_path: t.Optional[str], out_format: str, index_cache: t.Optional[str]):
+    """
+    ddsx_index: index of ddsx textures from their headers
+
+    PATH: .ddsx, .dxp.bin or .vromfs.bin file, or directory with them
+
+    -o, --output: output file, by default stdout for csv and jsonl, required for sqlite
+
+    --format: csv, jsonl or sqlite table `textures`
+
+    example: `ddsx_index --format sqlite -o textures.db tex.vromfs.bin grp_hdr.vromfs.bin res`
+    """
+
+    errors = []
+    records = scan(paths, errors, index_cache)
+    if out_format == SQLITE:
+        if not output_path:
+            raise click.UsageError("Output path is required for sqlite format")
+        count = write_sqlite(records, output_path)
+    else:
+        write = write_csv if out_format == CSV else write_jsonl
+        if output_path:
+            with open(output_path, 'w', newline='', encoding='utf8') as ostream:
+                count = write(records, ostream)
+        else:
+            count = write(records, sys.stdout)
+
+    for path, error in errors:
+        print("[FAIL] {}: {}".format(path, error), file=sys.stderr)
+    print("[{}] {} textures".format('FAIL' if errors else 'OK', count), file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import ctypes
+import multiprocessing as mp
 import os.path
 import struct
 import sys
+import threading
+import typing as t
 import zlib
 
+import click
 import pylzma
 import zstandard
 
 try:
     from formats.common import get_tool_path
-    from formats.ddsx_parser import ddsx
+    from formats.ddsx_parser import compression_type, ddsx_header
+    from progress import progressbar
 except ImportError:
     from wt_tools.formats.common import get_tool_path
-    from wt_tools.formats.ddsx_parser import ddsx
+    from wt_tools.formats.ddsx_parser import compression_type, ddsx_header
+    from wt_tools.progress import progressbar
 
 ddsx_types = [b'DXT1', b'DXT5']
 
@@ -35,8 +42,6 @@ dds_header = [
     0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00
 ]
 
-compression_type = {0x0: "not_packed", 0x20: "zstd", 0x40: "lzma", 0x60: "oodle", 0x80: "zlib"}
-
 dll_name = 'oo2core_6_win64.dll'
 dll_real_path = os.path.join(get_tool_path(), dll_name)
 oodle_dll = None
@@ -48,140 +53,248 @@ else:
     oodle_dll = ctypes.cdll.LoadLibrary(dll_real_path)
 
 
-def unpack(data: bytes):
-    """
-    Unpack data from ddsx and returns it. If data have wrong header, prints error
-    and return None. Return unpacked dds data, ready for saving.
+class DdsxError(Exception):
+    pass
 
-    :param data: ddsx data
-    """
-    parsed_data = ddsx.parse(data)
-    texture_format = parsed_data.header.d3dFormat
-    if texture_format not in ddsx_types:
-        print("Texture format {} unsupported yet".format(texture_format))
-        return
 
-    dds_compression_type = struct.unpack_from('B', data, 0xb)[0]
+# decompressors and buffers of a thread, reused for all its textures
+_local = threading.local()
 
-    dds_data = ctypes.create_string_buffer(0x80)
-    struct.pack_into('128B', dds_data, 0, *dds_header)
-    struct.pack_into('I', dds_data, 0xc, parsed_data.header.h)
-    struct.pack_into('I', dds_data, 0x10, parsed_data.header.w)
-    struct.pack_into('I', dds_data, 0x14, parsed_data.header.memSz)
-    struct.pack_into('B', dds_data, 0x1c, parsed_data.header.levels)
-    struct.pack_into('4s', dds_data, 0x54, parsed_data.header.d3dFormat)
 
-    dds_packed = compression_type.get(dds_compression_type, "")
+def _zstd_decompressor() -> zstandard.ZstdDecompressor:
+    dctx = getattr(_local, 'dctx', None)
+    if dctx is None:
+        dctx = _local.dctx = zstandard.ZstdDecompressor()
+    return dctx
+
+
+def _oodle_buffer(size: int):
+    buffer = getattr(_local, 'oodle_buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _local.oodle_buffer = ctypes.create_string_buffer(size)
+    return buffer
+
+
+def get_dxt_size(t_width, t_height, dxt_version):
+    # https://docs.microsoft.com/en-us/windows/win32/direct3ddds/dds-file-layout-for-textures
+    dxt_size = max(1, (t_width + 3) // 4) * max(1, (t_height + 3) // 4)
+    if dxt_version == b'DXT1':
+        return dxt_size * 8
+    elif dxt_version == b'DXT5':
+        return dxt_size * 16
+    raise DdsxError("unknown dxt version: {}".format(dxt_version))
+
+
+def _decompress(dds_packed: str, data: bytes, header) -> t.Union[bytes, memoryview]:
+    """Texture data of ddsx, codec errors are raised as they are."""
+
+    body = memoryview(data)[0x20:]
     if dds_packed == "not_packed":
-        d_data = data[0x20:]
+        d_data = body
     elif dds_packed == "lzma":
-        d_data = pylzma.decompress(data[0x20:], maxlength=parsed_data.header.memSz)
+        d_data = pylzma.decompress(data[0x20:], maxlength=header.memSz)
     elif dds_packed == "zlib":
-        d_data = zlib.decompress(data[0x20:])
+        d_data = zlib.decompress(body)
     elif dds_packed == "oodle":
         '''
         private static extern long OodleLZ_Decompress(byte[] buffer, long bufferSize, byte[] result,
             long outputBufferSize, int a, int b, int c, long d, long e,
             long f, long g, long h, long i, int ThreadModule);
         '''
-        if oodle_dll:
-            decompressed_data = ctypes.create_string_buffer(parsed_data.header.memSz)
-            res = oodle_dll.OodleLZ_Decompress(data[0x20:], parsed_data.header.packedSz,
-                                               decompressed_data,
-                                               parsed_data.header.memSz, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-                                               3)
-            if res == 0:
-                print("Error unpacking oodle compressed texture")
-                return
-            d_data = decompressed_data.raw
-        else:
-            print("unsupported compression type: {}".format(dds_packed))
+        if not oodle_dll:
+            raise DdsxError("unsupported compression type: {}".format(dds_packed))
+        decompressed_data = _oodle_buffer(header.memSz)
+        res = oodle_dll.OodleLZ_Decompress(data[0x20:], header.packedSz, decompressed_data, header.memSz,
+                                           0, 0, 0, 0, 0, 0, 0, 0, 0, 3)
+        if res == 0:
+            raise DdsxError("Error unpacking oodle compressed texture")
+        d_data = memoryview(decompressed_data)[:header.memSz]
     elif dds_packed == "zstd":
-        dctx = zstandard.ZstdDecompressor()
-        d_data = dctx.decompress(data[0x20:], max_output_size=parsed_data.header.memSz)
-        if d_data == 0:
-            print("Error unpacking zstd compressed texture")
-            return
+        d_data = _zstd_decompressor().decompress(body, max_output_size=header.memSz)
     else:
-        print("Unknown compression type: {}".format(dds_compression_type))
-        return
+        raise DdsxError("Unknown compression type: {}".format(dds_packed))
+    return d_data
 
-    if not d_data:
-        print("unpacked data empty somehow")
-        return
 
-    if parsed_data.header.flags.FLG_REV_MIP_ORDER:
+def _unpack(data: bytes) -> t.Sequence[t.Union[bytes, bytearray, memoryview]]:
+    """
+    Unpack data from ddsx.
+
+    :param data: ddsx data
+    :return parts of dds data, the last one may be a view of a buffer of the thread, valid until its next texture
+    :raise DdsxError: unsupported or broken texture
+    """
+
+    header = ddsx_header.parse(data)
+    texture_format = header.d3dFormat
+    if texture_format not in ddsx_types:
+        raise DdsxError("Texture format {} unsupported yet".format(texture_format))
+
+    dds_compression_type = struct.unpack_from('B', data, 0xb)[0]
+
+    dds_data = bytearray(dds_header)
+    struct.pack_into('I', dds_data, 0xc, header.h)
+    struct.pack_into('I', dds_data, 0x10, header.w)
+    struct.pack_into('I', dds_data, 0x14, header.memSz)
+    struct.pack_into('B', dds_data, 0x1c, header.levels)
+    struct.pack_into('4s', dds_data, 0x54, header.d3dFormat)
+
+    dds_packed = compression_type.get(dds_compression_type)
+    if not dds_packed:
+        raise DdsxError("Unknown compression type: {}".format(dds_compression_type))
+    try:
+        d_data = _decompress(dds_packed, data, header)
+    except DdsxError:
+        raise
+    except Exception as e:
+        # zlib.error, TypeError of pylzma, ZstdError
+        raise DdsxError("Error unpacking {} compressed texture: {}: {}".format(
+            dds_packed, type(e).__name__, e)) from None
+
+    if not len(d_data):
+        raise DdsxError("unpacked data empty somehow")
+
+    if header.flags.FLG_REV_MIP_ORDER:
         # Reverse MIPMAP order (from smallest -> biggest to biggest -> smallest)
         if texture_format in [b'DXT1', b'DXT5']:
-            # https://docs.microsoft.com/en-us/windows/win32/direct3ddds/dds-file-layout-for-textures
-            def get_dxt1_size(t_width, t_height, dxt_version):
-                dxt_size = max(1, (t_width + 3) // 4) * max(1, (t_height + 3) // 4)
-                if dxt_version == b'DXT1':
-                    return dxt_size * 8
-                elif dxt_version == b'DXT5':
-                    return dxt_size * 16
-                else:
-                    print("unknown dxt version: {}", dxt_version)
-                    return
-
+            d_data = memoryview(d_data)
             pos = 0
             images = []
-            for level in range(parsed_data.header.levels - 1, -1, -1):
-                width = parsed_data.header.w // (2 ** level)
-                height = parsed_data.header.h // (2 ** level)
-                size = get_dxt1_size(width, height, texture_format)
+            for level in range(header.levels - 1, -1, -1):
+                width = header.w // (2 ** level)
+                height = header.h // (2 ** level)
+                size = get_dxt_size(width, height, texture_format)
                 images.append(d_data[pos:pos + size])
                 pos += size
+            return [dds_data, *reversed(images)]
 
-            d_data = bytearray()
-            for image in reversed(images):
-                d_data.extend(image)
-
-        elif parsed_data.header.levels > 1:
+        elif header.levels > 1:
             # left unpacked data as is
             print("Dunno how to re-order mipmaps for format {}".format(texture_format))
 
-    return dds_data.raw + d_data
+    return [dds_data, d_data]
 
 
-def unpack_file(filename):
-    # TODO: eliminate copy&paste with blk_unpack
+def unpack(data: bytes):
+    """
+    Unpack data from ddsx and returns it. If data have wrong header, prints error
+    and return None. Return unpacked dds data, ready for saving.
+
+    :param data: ddsx data
+    """
+
+    try:
+        return b''.join(_unpack(data))
+    except DdsxError as e:
+        print(e)
+        return None
+
+
+def _unpack_file(filename: str):
     with open(filename, 'rb') as f:
         data = f.read()
     if len(data) == 0:
-        print("empty file")
-        return
-    out_file = unpack(data)
-    if out_file:
-        with open(filename[:-1], 'wb') as f:
-            f.write(out_file)
+        raise DdsxError("empty file")
+    parts = _unpack(data)
+    with open(filename[:-1], 'wb') as f:
+        for part in parts:
+            f.write(part)
 
 
-def unpack_dir(dirname):
-    """
-    Unpack all *.ddsx files in `dirname`
-    """
+def _unpack_file_task(filename: str) -> t.Tuple[str, t.Optional[str]]:
+    try:
+        _unpack_file(filename)
+    except Exception as e:
+        return filename, str(e) if isinstance(e, DdsxError) else '{}: {}'.format(type(e).__name__, e)
+    return filename, None
+
+
+def unpack_file(filename):
+    filename, error = _unpack_file_task(filename)
+    if error:
+        print(error)
+
+
+def find_ddsx_files(dirname) -> t.List[str]:
+    """*.ddsx files in `dirname`, largest first."""
+
+    found = []
     for root, dirs, files in os.walk(dirname):
         for filename in files:
             subname = os.path.join(root, filename)
-            if os.path.isfile(subname) and os.path.splitext(subname)[1] == '.ddsx':
-                print("\n" + subname)
-                unpack_file(subname)
+            if os.path.splitext(subname)[1] == '.ddsx' and os.path.isfile(subname):
+                found.append((os.path.getsize(subname), subname))
+    found.sort(reverse=True)
+    return [subname for _, subname in found]
 
 
-def main():
-    if len(sys.argv) != 2:
-        print('usage: ddsx_unpack.py PATH\n'
-              'where PATH - file or folder')
-        sys.exit(1)
+def is_lzma(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        head = f.read(0xc)
+    return len(head) == 0xc and compression_type.get(head[0xb]) == "lzma"
 
-    filename = sys.argv[1]
 
-    if os.path.isfile(filename):
-        unpack_file(filename)
-    else:
-        unpack_dir(filename)
+def unpack_dir(dirname, jobs: int = 1, quiet: bool = False) -> t.List[t.Tuple[str, str]]:
+    """
+    Unpack all *.ddsx files in `dirname`.
+    zstd, zlib and oodle textures are unpacked by threads, they release GIL while unpacking;
+    lzma textures are unpacked by processes.
+
+    :param jobs: number of threads and of processes
+    :param quiet: do not show progress
+    :return (path, error message) for files that have not been unpacked
+    """
+
+    filenames = find_ddsx_files(dirname)
+    errors = []
+    with progressbar(quiet, length=len(filenames), label="Unpacking textures") as bar:
+        if jobs > 1 and len(filenames) > 1:
+            lzma_filenames = [filename for filename in filenames if is_lzma(filename)]
+            lzma_set = set(lzma_filenames)
+            other_filenames = [filename for filename in filenames if filename not in lzma_set]
+            with ThreadPoolExecutor(jobs) as threads, ProcessPoolExecutor(jobs) as processes:
+                futures = [threads.submit(_unpack_file_task, filename) for filename in other_filenames]
+                if lzma_filenames:
+                    chunksize = max(1, len(lzma_filenames) // (jobs * 8))
+                    results = processes.map(_unpack_file_task, lzma_filenames, chunksize=chunksize)
+                    for result in results:
+                        errors.append(result)
+                        bar.update(1)
+                for future in as_completed(futures):
+                    errors.append(future.result())
+                    bar.update(1)
+        else:
+            for filename in filenames:
+                errors.append(_unpack_file_task(filename))
+                bar.update(1)
+
+    return sorted((filename, error) for filename, error in errors if error)
+
+
+@click.command()
+@click.argument('path', type=click.Path(exists=True))
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1), default=1, show_default=True)
+@click.option('-q', '--quiet', 'quiet', is_flag=True, default=False, help="do not show progress")
+def main(path: str, jobs: int, quiet: bool):
+    """
+    ddsx_unpack: unpacks ddsx textures into dds files
+
+    PATH: file or folder
+
+    -j, --jobs: number of threads for zstd, zlib and oodle textures and of processes for lzma textures
+    """
+
+    if os.path.isfile(path):
+        unpack_file(path)
+        return
+
+    errors = unpack_dir(path, jobs, quiet)
+    for filename, error in errors:
+        print("[FAIL] {}: {}".format(filename, error), file=sys.stderr)
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
+    mp.freeze_support()
     main()
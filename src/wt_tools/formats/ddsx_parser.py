@@ -1,3 +1,5 @@
+import struct
+
 from construct import Struct, Int32ul, Int16ul, Int8ul, Nibble, Const, IfThenElse, this, Bytes, BitStruct
 
 from .common import FlagsEnumCumulative
@@ -101,3 +103,9 @@ ddsx = Struct(
         Bytes(this.header.memSz)
     )
 )
+
+# the same header for reading many headers without construct: label, d3dFormat, flags, w, h, levels, hqPartLevels,
+# depth, bitsPerPixel, bits_, memSz, packedSz
+ddsx_header_struct = struct.Struct('<4s4sIHHBBHH2sII')
+
+compression_type = {0x0: "not_packed", 0x20: "zstd", 0x40: "lzma", 0x60: "oodle", 0x80: "zlib"}
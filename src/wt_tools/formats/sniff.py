@@ -0,0 +1,63 @@
+"""
+Cheap file type detection by magic and a scan for control bytes, without parsing.
+
+Blks are classified as they are written by vromfs_unpacker: a slim blk starts with zero byte, a fat blk has its names
+inside, a text blk has no control bytes.
+"""
+
+import typing as t
+
+EMPTY = 'empty'
+BBF = 'bbf'
+BBZ = 'bbz'
+SLIM = 'slim'
+FAT = 'fat'
+TEXT = 'text'
+DDSX = 'ddsx'
+DXP = 'dxp'
+WRPL = 'wrpl'
+VROMFS = 'vromfs'
+
+magics = (
+    (b'\x00BBF', BBF),
+    (b'\x00BBz', BBZ),
+    (b'DDSx', DDSX),
+    (b'DxP2', DXP),
+    (b'\xe5\xac\x00\x10', WRPL),
+    (b'VRFs', VROMFS),
+    (b'VRFx', VROMFS),
+)
+
+# control bytes which are not met in text blks, tab, line feed, carriage return and 0x1a-0x1f are allowed
+restricted_bytes = bytes.fromhex('00 01 02 03 04 05 06 07 08 0b 0c 0e 0f 10 11 12 13 14 15 16 17 18 19')
+_allowed_bytes = bytes(b for b in range(0x100) if b not in restricted_bytes)
+
+
+def is_text(bs: t.Union[bytes, bytearray, memoryview]) -> bool:
+    """True if there are no restricted control bytes in bs."""
+
+    if not isinstance(bs, (bytes, bytearray)):
+        bs = bytes(bs)
+    # only restricted bytes are left
+    return not bs.translate(None, _allowed_bytes)
+
+
+def sniff(bs: t.Union[bytes, bytearray, memoryview]) -> str:
+    """
+    Type of the file content.
+
+    :param bs: the whole content, a head of 4 bytes is enough for all types but text and fat blk
+    :return: one of EMPTY, BBF, BBZ, DDSX, DXP, WRPL, VROMFS, SLIM, TEXT, FAT
+    """
+
+    if not len(bs):
+        return EMPTY
+    head = bytes(bs[:4])
+    for magic, type_ in magics:
+        if head == magic:
+            return type_
+    if not head[0]:
+        return SLIM
+    if is_text(bs):
+        return TEXT
+    return FAT
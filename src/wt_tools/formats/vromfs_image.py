@@ -0,0 +1,381 @@
+"""
+Lazy reader of .vromfs.bin images.
+
+Unlike vromfs_file.parse, only the header, the filename table and the file data table are decoded when an image is
+opened. Entry payloads are handed out as memoryview slices of the image body: a not packed body is read straight from a
+memory mapped file, a packed body is decompressed once and is not copied afterwards.
+
+A zstd packed body is decompressed only up to the end of the tables and then up to the end of the entries asked for.
+Decoded tables may be kept in an IndexCache, then the tables are not decompressed again.
+"""
+
+from hashlib import md5
+import json
+import mmap
+import os
+import struct
+import threading
+import typing as t
+import zlib
+
+import zstandard
+
+from .vromfs_parser import vromfs_header, vromfs_ext_header, DeobfsReader, NOT_PACKED, ZSTD_PACKED, ZLIB_PACKED, \
+    ZSTD_PACKED_NOCHECK
+
+Path = t.Union[t.AnyStr, os.PathLike]
+
+HEADER_SIZE = 0x10
+EXT_HEADER_SIZE = 0x8
+MD5_SIZE = 0x10
+
+# filename_table_offset, files_count, filedata_table_offset
+body_header_struct = struct.Struct('<II8xI')
+# file_data_offset, file_data_size
+file_data_record_struct = struct.Struct('<II8x')
+first_filename_offset_struct = struct.Struct('<I')
+
+NM_NAME = b'\xff?nm'
+
+
+class VromfsImageError(RuntimeError):
+    """
+    Throws when image can not be read
+    """
+
+
+def index_key(name: str) -> str:
+    """
+    Key of the name index: leading slashes are dropped (there was a bug in 1.99.1.70 with "/version" file path),
+    case and separators are normalized for the current platform.
+    """
+
+    return os.path.normcase(name.lstrip('/\\'))
+
+
+def read_tables(buffer: t.Union[bytes, memoryview], base: int = 0) -> t.Tuple[t.List[str], t.List[t.Tuple[int, int]]]:
+    """
+    Decode the filename table and the file data table of an image body.
+
+    Names are stored one after another starting from the first name offset, so the whole block is split at once instead
+    of searching every name terminator, records are unpacked in one pass.
+
+    :param buffer: image body or a buffer holding it
+    :param base: offset of the body in the buffer
+    :return: names, (file_data_offset, file_data_size) records
+    """
+
+    filename_table_offset, files_count, filedata_table_offset = body_header_struct.unpack_from(buffer, base)
+    if not files_count:
+        return [], []
+
+    start = base + first_filename_offset_struct.unpack_from(buffer, base + filename_table_offset)[0]
+    # names are followed by the file data table, take the rest of the buffer for other layouts
+    end = base + filedata_table_offset
+    if end <= start:
+        end = len(buffer)
+    names = bytes(buffer[start:end]).split(b'\x00', files_count)
+    if len(names) <= files_count:
+        raise VromfsImageError("Unterminated filename table at {:#x}".format(start - base))
+    del names[files_count:]
+    names = ['nm' if name == NM_NAME else name.decode('utf8') for name in names]
+
+    records_start = base + filedata_table_offset
+    records_end = records_start + files_count * file_data_record_struct.size
+    if records_end > len(buffer):
+        raise VromfsImageError("Truncated file data table at {:#x}".format(filedata_table_offset))
+    records = list(file_data_record_struct.iter_unpack(buffer[records_start:records_end]))
+    return names, records
+
+
+class VromfsEntry:
+    """
+    File of an image: name, place and size of its data in the image body.
+    Field names follow vromfs_parser.file_data_record.
+    """
+
+    __slots__ = ('image', 'index', 'filename', 'file_data_offset', 'file_data_size')
+
+    def __init__(self, image: 'VromfsImage', index: int, filename: str, file_data_offset: int, file_data_size: int):
+        self.image = image
+        self.index = index
+        self.filename = filename
+        self.file_data_offset = file_data_offset
+        self.file_data_size = file_data_size
+
+    @property
+    def data(self) -> memoryview:
+        return self.image.data(self.index)
+
+    @property
+    def hexdigest(self) -> str:
+        """md5 of data as hex string."""
+
+        return self.image.hexdigest(self.index)
+
+    def __repr__(self):
+        return '{}({!r}, offset={}, size={})'.format(
+            type(self).__name__, self.filename, self.file_data_offset, self.file_data_size)
+
+
+def _close_mmap(mm: mmap.mmap):
+    try:
+        mm.close()
+    except BufferError:
+        # payload views are still alive, the map is released with the last of them
+        pass
+
+
+class IndexCache:
+    """
+    Directory of decoded image tables, one json file per image path.
+
+    A record is used while the image has the same size, mtime, header and body md5, otherwise it is rewritten.
+    The cache is an optimization only: unreadable or stale records are ignored, failed writes are skipped.
+
+    A record keeps md5 of every entry, so the image opened with a cold or stale record is decompressed as a whole and
+    all its entries are hashed before the record is written.
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+
+    def record_path(self, image_path: Path) -> str:
+        abs_path = os.path.abspath(os.fsdecode(image_path))
+        name = md5(abs_path.encode('utf8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.cache_dir, name + '.json')
+
+    def load(self, key: dict) -> t.Optional[dict]:
+        try:
+            with open(self.record_path(key['path'])) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(record, dict) or record.get('version') != self.VERSION or record.get('key') != key:
+            return None
+        return record
+
+    def save(self, key: dict, tables: dict):
+        record = dict(tables, version=self.VERSION, key=key)
+        path = self.record_path(key['path'])
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(record, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+
+class VromfsImage:
+    """
+    Read only view of a .vromfs.bin image.
+
+    A packed body is streamed through the decompressor into an anonymous map of original_size, so it is held in
+    memory once. Entry payloads are memoryview slices of the image, they are valid until the image is closed.
+
+    >>> with VromfsImage('char.vromfs.bin') as image:
+    ...     for entry in image:
+    ...         print(entry.filename, entry.file_data_size)
+    """
+
+    def __init__(self, path: Path, index_cache: t.Optional[IndexCache] = None):
+        self.path = path
+        self._index_cache = index_cache
+        self._lock = threading.Lock()
+        self._reader = None
+        self._hashes: t.Optional[t.List[str]] = None
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self):
+        mm = self._mm
+        self.header = vromfs_header.parse(mm[:HEADER_SIZE])
+        offset = HEADER_SIZE
+        if self.header.magic == 'vrfx':
+            self.ext_header = vromfs_ext_header.parse(mm[offset:offset + EXT_HEADER_SIZE])
+            offset += EXT_HEADER_SIZE
+        else:
+            self.ext_header = None
+        self.vromfs_offset = offset
+
+        packed_type = self.header.vromfs_packed_type
+        original_size = self.header.original_size
+        packed_size = self.header.packed_size
+
+        if packed_type == NOT_PACKED:
+            self._buffer = mm
+            self._base = offset
+            end = offset + original_size
+        elif packed_type == ZSTD_PACKED:
+            # the body is decompressed on demand, see _fill
+            self._buffer = mmap.mmap(-1, original_size) if original_size else b''
+            reader = DeobfsReader(mm, offset, packed_size)
+            self._reader = zstandard.ZstdDecompressor().stream_reader(reader)
+            self._base = 0
+            end = offset + packed_size
+        elif packed_type == ZLIB_PACKED:
+            zdo = zlib.decompressobj()
+            self._buffer = zdo.decompress(mm[offset:])
+            self._base = 0
+            end = len(mm) - len(zdo.unused_data)
+        else:
+            raise VromfsImageError("Unknown vromfs packed type: {}".format(self.header.vromfs_type))
+
+        if self.header.vromfs_type != ZSTD_PACKED_NOCHECK:
+            self.md5: t.Optional[bytes] = mm[end:end + MD5_SIZE]
+        else:
+            self.md5 = None
+
+        self._view = memoryview(self._buffer)
+        self._filled = 0 if self._reader else len(self._buffer)
+        self._index: t.Optional[t.Dict[str, VromfsEntry]] = None
+
+        # zlib packed body is already decompressed, its end is known only after that
+        cache_key = self._cache_key() if self._index_cache and packed_type != ZLIB_PACKED else None
+        record = self._index_cache.load(cache_key) if cache_key else None
+        if record and len(record['names']) == len(record['offsets']) == len(record['sizes']) == len(record['hashes']):
+            self.entries: t.List[VromfsEntry] = [
+                VromfsEntry(self, i, name, offset, size)
+                for i, (name, offset, size) in enumerate(zip(record['names'], record['offsets'], record['sizes']))]
+            self._hashes = record['hashes']
+        else:
+            self.entries = self._read_tables()
+            if cache_key:
+                self._fill(len(self._view))
+                self._index_cache.save(cache_key, {
+                    'packed_type': packed_type,
+                    'names': self.names,
+                    'offsets': [entry.file_data_offset for entry in self.entries],
+                    'sizes': [entry.file_data_size for entry in self.entries],
+                    'hashes': [self.hexdigest(i) for i in range(len(self.entries))],
+                })
+
+    def _cache_key(self) -> dict:
+        st = os.fstat(self._file.fileno())
+        header = self._mm[:self.vromfs_offset] + (self.md5 or b'')
+        return {
+            'path': os.path.abspath(os.fsdecode(self.path)),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'header_md5': md5(header).hexdigest(),
+        }
+
+    def _fill(self, end: int):
+        """Decompress the packed body at least up to end."""
+
+        end = min(end, len(self._view))
+        if end <= self._filled:
+            return
+        with self._lock:
+            view = self._view
+            while self._filled < end:
+                n = self._reader.readinto(view[self._filled:end])
+                if not n:
+                    raise VromfsImageError("Packed body ends at {:#x} of {:#x}".format(self._filled, len(view)))
+                self._filled += n
+            if self._filled == len(view):
+                self._reader.close()
+                self._reader = None
+
+    def _fill_tables(self):
+        """Decompress the packed body up to the end of the filename table and the file data table."""
+
+        base = self._base
+        self._fill(base + body_header_struct.size)
+        filename_table_offset, files_count, filedata_table_offset = body_header_struct.unpack_from(self._view, base)
+        if not files_count:
+            return
+        self._fill(base + filename_table_offset + first_filename_offset_struct.size)
+        names_offset = first_filename_offset_struct.unpack_from(self._view, base + filename_table_offset)[0]
+        if filedata_table_offset <= names_offset:
+            # names are not followed by the file data table, their end is unknown
+            self._fill(len(self._view))
+        else:
+            self._fill(base + filedata_table_offset + files_count * file_data_record_struct.size)
+
+    def _read_tables(self) -> t.List[VromfsEntry]:
+        self._fill_tables()
+        names, records = read_tables(self._view, self._base)
+        return [VromfsEntry(self, i, name, offset, size) for i, (name, (offset, size)) in enumerate(zip(names, records))]
+
+    @property
+    def packed_type(self) -> str:
+        return self.header.vromfs_packed_type
+
+    @property
+    def names(self) -> t.List[str]:
+        return [entry.filename for entry in self.entries]
+
+    @property
+    def index(self) -> t.Mapping[str, VromfsEntry]:
+        """Entries by index_key of their names, the first one wins for duplicated names."""
+
+        if self._index is None:
+            index = {}
+            for entry in self.entries:
+                index.setdefault(index_key(entry.filename), entry)
+            self._index = index
+        return self._index
+
+    def find(self, name: str) -> t.Optional[VromfsEntry]:
+        return self.index.get(index_key(name))
+
+    def data(self, index: int) -> memoryview:
+        entry = self.entries[index]
+        offset = self._base + entry.file_data_offset
+        end = offset + entry.file_data_size
+        self._fill(end)
+        return self._view[offset:end]
+
+    def hexdigest(self, index: int) -> str:
+        """md5 of the entry data as hex string, taken from the index cache if possible."""
+
+        if self._hashes is not None:
+            return self._hashes[index]
+        return md5(self.data(index)).hexdigest()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self) -> t.Iterator[VromfsEntry]:
+        return iter(self.entries)
+
+    def __getitem__(self, index: int) -> VromfsEntry:
+        return self.entries[index]
+
+    def close(self):
+        reader = getattr(self, '_reader', None)
+        if reader is not None:
+            reader.close()
+            self._reader = None
+        view = getattr(self, '_view', None)
+        if view is not None:
+            try:
+                view.release()
+            except BufferError:
+                pass
+            self._view = None
+        mm = getattr(self, '_mm', None)
+        buffer = getattr(self, '_buffer', None)
+        if isinstance(buffer, mmap.mmap) and buffer is not mm:
+            _close_mmap(buffer)
+        self._buffer = None
+        if mm is not None:
+            _close_mmap(mm)
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self) -> 'VromfsImage':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
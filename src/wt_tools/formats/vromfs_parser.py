@@ -1,3 +1,4 @@
+import io
 import struct
 
 import zstandard
@@ -27,20 +28,74 @@ vromfs_type = Enum(
 )
 
 
+OBFS16_KEY = (0xAA55AA55, 0xF00FF00F, 0xAA55AA55, 0x12481248)
+OBFS32_KEY = (0x12481248, 0xAA55AA55, 0xF00FF00F, 0xAA55AA55)
+
+
+def deobfs(bs, key) -> bytes:
+    return struct.pack("<4L", *[x ^ y for (x, y) in zip(struct.unpack("<4L", bs), key)])
+
+
+class DeobfsReader(io.RawIOBase):
+    """
+    Reads packed data of a zstd packed body from buffer with the obfuscated head and tail restored.
+    Only these 32 bytes are copied, the middle part is read from buffer as is.
+    """
+
+    def __init__(self, buffer, offset: int, packed_size: int):
+        super(DeobfsReader, self).__init__()
+        self._view = memoryview(buffer)[offset:offset + packed_size]
+        self._size = packed_size
+        self._pos = 0
+        self._patches = []
+        if packed_size >= 16:
+            self._patches.append((0, deobfs(self._view[:16], OBFS16_KEY)))
+        if packed_size >= 32:
+            # ugly: align with 4 bytes
+            second_part_offset = 16 + (packed_size - 32) // 4 * 4
+            self._patches.append((second_part_offset,
+                                  deobfs(self._view[second_part_offset:second_part_offset + 16], OBFS32_KEY)))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        start = self._pos
+        n = min(len(b), self._size - start)
+        if n <= 0:
+            return 0
+        end = start + n
+        with memoryview(b) as out:
+            out[:n] = self._view[start:end]
+            for patch_start, patch in self._patches:
+                patch_end = patch_start + len(patch)
+                if patch_start < end and start < patch_end:
+                    lo = max(start, patch_start)
+                    hi = min(end, patch_end)
+                    out[lo - start:hi - start] = patch[lo - patch_start:hi - patch_start]
+        self._pos = end
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super(DeobfsReader, self).close()
+
+
+def read_zstd_body(buffer, offset: int, packed_size: int, original_size: int) -> bytes:
+    dctx = zstandard.ZstdDecompressor()
+    with dctx.stream_reader(DeobfsReader(buffer, offset, packed_size)) as reader:
+        return reader.read(original_size)
+
+
 class ZstdContext(Construct):
     def __init__(self):
         super(ZstdContext, self).__init__()
 
     def _parse(self, stream, ctx, path):
-        need_read_size = ctx._._.header.packed_size - (16 if ctx.first_part else 0) - (16 if ctx.second_part else 0)
-        # ugly: align read size to 4 bytes
-        need_read_size = need_read_size // 4 * 4
-        deobfs_compressed_data = (ctx.first_part if ctx.first_part else b'') + \
-                                 stream.getvalue()[ctx.middle_data_offset:ctx.middle_data_offset + need_read_size] + \
-                                 (ctx.second_part.data if ctx.second_part.data else b'') + \
-                                 (ctx.align_tail if ctx.align_tail else b'')
-        dctx = zstandard.ZstdDecompressor()
-        ctx.decompressed_data = dctx.decompress(deobfs_compressed_data, max_output_size=ctx._._.header.original_size)
+        # stream the deobfuscated data through zstd, without glueing packed parts together
+        ctx.decompressed_data = read_zstd_body(stream.getvalue(), ctx.before_obfs, ctx._._.header.packed_size,
+                                               ctx._._.header.original_size)
 
 
 class ZlibAdapter(Adapter):
@@ -50,12 +105,12 @@ class ZlibAdapter(Adapter):
 
 class Obfs16Adapter(Adapter):
     def _decode(self, obj, context, path):
-        return struct.pack("<4L", *[x ^ y for (x, y) in zip(obj, [0xAA55AA55, 0xF00FF00F, 0xAA55AA55, 0x12481248])])
+        return struct.pack("<4L", *[x ^ y for (x, y) in zip(obj, OBFS16_KEY)])
 
 
 class Obfs32Adapter(Adapter):
     def _decode(self, obj, context, path):
-        return struct.pack("<4L", *[x ^ y for (x, y) in zip(obj, [0x12481248, 0xAA55AA55, 0xF00FF00F, 0xAA55AA55])])
+        return struct.pack("<4L", *[x ^ y for (x, y) in zip(obj, OBFS32_KEY)])
 
 
 '''
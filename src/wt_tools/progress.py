@@ -0,0 +1,11 @@
+import io
+import click
+
+
+def progressbar(quiet: bool, *args, **kwargs):
+    """click.progressbar, which shows nothing when quiet."""
+
+    if quiet:
+        # the bar is written to a discarded stream
+        kwargs['file'] = io.StringIO()
+    return click.progressbar(*args, **kwargs)
@@ -0,0 +1,245 @@
+"""
+Unpacks blk files of .vromfs.bin straight into .blkx files.
+
+Unlike vromfs_unpacker followed by blk_unpack_ng, blks are not written to disk and read back: they are decoded from the
+image in memory with the names and the zstd dictionary of the image. The image is decompressed once, by the main
+process, workers get the names and the dictionary once and then packed blks.
+"""
+
+import io
+import multiprocessing as mp
+import os
+import sys
+import time
+import typing as t
+import click
+import zstandard as zstd
+try:
+    from formats.vromfs_image import VromfsImage
+    from vromfs_unpacker import get_blk_content, get_shared_names_content, get_zstd_dict, has_shared_names, \
+        make_decompressor, mkdir_p, normalize_name
+    from progress import progressbar
+    from formats.sniff import sniff, BBF, BBZ, EMPTY, SLIM, TEXT
+    import blk_minify
+    from blk_unpack_ng import create_text, serialize_text, unpack_bbf
+except ImportError:
+    from wt_tools.formats.vromfs_image import VromfsImage
+    from wt_tools.vromfs_unpacker import get_blk_content, get_shared_names_content, get_zstd_dict, \
+        has_shared_names, make_decompressor, mkdir_p, normalize_name
+    from wt_tools.progress import progressbar
+    from wt_tools.formats.sniff import sniff, BBF, BBZ, EMPTY, SLIM, TEXT
+    import wt_tools.blk_minify as blk_minify
+    from wt_tools.blk_unpack_ng import create_text, serialize_text, unpack_bbf
+import blk.binary as bin
+import blk.text as txt
+import blk.json as jsn
+
+Path = t.Union[str, os.PathLike]
+
+out_types = {
+    'strict_blk': txt.STRICT_BLK,
+    'json': jsn.JSON,
+    'json_2': jsn.JSON_2,
+    'json_3': jsn.JSON_3,
+    'min_blk': blk_minify.MIN_BLK,
+    'min_blk_stripped': blk_minify.MIN_BLK_STRIPPED,
+}
+
+
+class BlkData(t.NamedTuple):
+    """Entry data handed to a worker, enough for get_blk_content and get_shared_names_content."""
+
+    filename: str
+    data: bytes
+
+    @property
+    def file_data_size(self) -> int:
+        return len(self.data)
+
+
+def shared_data(image: VromfsImage) -> t.Tuple[t.Optional[bytes], t.Optional[bytes]]:
+    """
+    Raw zstd dictionary and packed nm of the image, None for missing ones.
+    Blks of the image can be decoded with them alone, without the image.
+    """
+
+    if not has_shared_names(image):
+        return None, None
+    zstd_dict = get_zstd_dict(image)
+    return zstd_dict.as_bytes() if zstd_dict else None, bytes(image.entries[-1].data)
+
+
+class BlkWriter:
+    """
+    Writes .blkx files of blks with the names and the zstd dictionary of their image, which are loaded once.
+    """
+
+    def __init__(self, dest_dir: Path, out_type: int, is_sorted: bool, dict_data: t.Optional[bytes] = None,
+                 nm_data: t.Optional[bytes] = None):
+        self.dest_dir = dest_dir
+        self.out_type = out_type
+        self.is_sorted = is_sorted
+        self.dctx = None
+        self.names = None
+        if nm_data is not None:
+            zstd_dict = zstd.ZstdCompressionDict(dict_data, dict_type=zstd.DICT_TYPE_AUTO) if dict_data else None
+            self.dctx = make_decompressor(zstd_dict)
+            nm_istream = io.BytesIO(get_shared_names_content(BlkData('nm', nm_data), self.dctx))
+            self.names = bin.compose_names_data(nm_istream)
+
+    def unpack_entry(self, entry) -> t.Tuple[str, t.Optional[str]]:
+        """
+        Write .blkx for the entry of the image or BlkData.
+
+        :return internal name, error message if the entry has not been unpacked
+        """
+
+        name = normalize_name(entry.filename)
+        try:
+            self._unpack_entry(entry, name)
+        except Exception as e:
+            return name, '{}: {}'.format(type(e).__name__, e)
+        return name, None
+
+    def _unpack_entry(self, entry, name: str):
+        bs = bytes(get_blk_content(entry, self.dctx))
+        out_path = os.path.join(self.dest_dir, os.path.splitext(name)[0] + '.blkx')
+        mkdir_p(out_path)
+
+        type_ = sniff(bs)
+        # пустой файл или текст
+        if type_ in (EMPTY, TEXT):
+            with open(out_path, 'wb') as ostream:
+                ostream.write(bs)
+        # файл прежнего формата
+        elif type_ in (BBF, BBZ):
+            ss = unpack_bbf(bs, self.out_type)
+            with create_text(out_path) as ostream:
+                ostream.write(ss)
+        # файл с именами в nm
+        elif type_ == SLIM:
+            if not self.names:
+                raise bin.ComposeError("NameMap not found")
+            root = bin.compose_slim_data(self.names, io.BytesIO(bs))
+            with create_text(out_path) as ostream:
+                serialize_text(root, ostream, self.out_type, self.is_sorted)
+        # файл с именами внутри
+        else:
+            root = bin.compose_fat_data(io.BytesIO(bs))
+            with create_text(out_path) as ostream:
+                serialize_text(root, ostream, self.out_type, self.is_sorted)
+
+
+def blk_entries(image: VromfsImage) -> t.List:
+    """Blk entries, largest first."""
+
+    entries = [entry for entry in image if entry.filename.endswith('.blk')]
+    entries.sort(key=lambda entry: entry.file_data_size, reverse=True)
+    return entries
+
+
+_blk_writer: t.Optional[BlkWriter] = None
+# a failed initializer would be restarted by the pool forever, the error is reported for every entry instead
+_init_error: t.Optional[str] = None
+
+
+def _init_worker(dest_dir: Path, out_type: int, is_sorted: bool, dict_data: t.Optional[bytes],
+                 nm_data: t.Optional[bytes]):
+    global _blk_writer, _init_error
+    try:
+        _blk_writer = BlkWriter(dest_dir, out_type, is_sorted, dict_data, nm_data)
+    except Exception as e:
+        _init_error = '{}: {}'.format(type(e).__name__, e)
+
+
+def _unpack_entry(entry: BlkData) -> t.Tuple[str, t.Optional[str]]:
+    if _init_error:
+        return normalize_name(entry.filename), _init_error
+    return _blk_writer.unpack_entry(entry)
+
+
+def unpack(filename: Path, dest_dir: Path, out_type: int = jsn.JSON, is_sorted: bool = False, jobs: int = 1,
+           quiet: bool = False) -> t.Tuple[int, t.Sequence[t.Tuple[str, str]]]:
+    """
+    Unpack blk files from .vromfs.bin into .blkx files, other files are skipped.
+
+    :param filename: path to .vromfs.bin file
+    :param dest_dir: path to output dir
+    :param out_type: one of out_types
+    :param is_sorted: sort keys in json output
+    :param jobs: number of processes. The image is opened and decompressed in this process only, workers get the
+        dictionary and the names once and then packed blks one by one. Broken names fail every blk
+    :param quiet: do not show progress
+    :return number of blks, (internal name, error message) for failed blks
+    """
+
+    with VromfsImage(filename) as image:
+        dict_data, nm_data = shared_data(image)
+        entries = blk_entries(image)
+        if jobs > 1 and len(entries) > 1:
+            tasks = (BlkData(entry.filename, bytes(entry.data)) for entry in entries)
+            chunksize = max(1, len(entries) // (jobs * 16))
+            initargs = (dest_dir, out_type, is_sorted, dict_data, nm_data)
+            with mp.Pool(jobs, initializer=_init_worker, initargs=initargs) as pool:
+                with progressbar(quiet, length=len(entries), label="Unpacking blks") as bar:
+                    results = []
+                    for result in pool.imap_unordered(_unpack_entry, tasks, chunksize):
+                        results.append(result)
+                        bar.update(1)
+        else:
+            writer = BlkWriter(dest_dir, out_type, is_sorted, dict_data, nm_data)
+            with progressbar(quiet, entries, label="Unpacking blks") as bar:
+                results = [writer.unpack_entry(entry) for entry in bar]
+
+    errors = sorted((name, error) for name, error in results if error)
+    return len(entries), errors
+
+
+@click.command()
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('-O', '--output', 'output_path', type=click.Path(), default=None)
+@click.option('--format', 'out_format', type=click.Choice(list(out_types), case_sensitive=False), default='json',
+              show_default=True)
+@click.option('--sort', 'is_sorted', is_flag=True, default=False)
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1), default=None)
+def main(filename: str, output_path: t.Optional[str], out_format: str, is_sorted: bool, jobs: t.Optional[int]):
+    """
+    vromfs_blk_unpacker: unpacks blk files of vromfs file into blkx files, without writing blk files
+
+    FILENAME: vromfs file
+
+    -O, --output: folder to unpack into, blkx files are written to its FILENAME subfolder, like
+    output_folder/some.vromfs.bin, the same as vromfs_unpacker does. By default is FILENAME with appended _u, like
+    some.vromfs.bin_u
+
+    --format: format of blkx files
+
+    --sort: sort keys in json formats
+
+    -j, --jobs: number of processes, by default number of CPUs
+
+    example: `vromfs_blk_unpacker aces.vromfs.bin --format strict_blk`
+    """
+
+    if output_path:
+        output_path = os.path.join(output_path, os.path.basename(filename))
+    else:
+        head, tail = os.path.split(filename)
+        output_path = os.path.join(head, tail + '_u')
+
+    start = time.perf_counter()
+    blks_count, errors = unpack(filename, output_path, out_types[out_format], is_sorted, jobs or os.cpu_count() or 1)
+    elapsed = time.perf_counter() - start
+
+    for name, error in errors:
+        print("[FAIL] {}: {}".format(name, error), file=sys.stderr)
+    print("[{}] {} => {}: {} of {} blks in {:.1f} s".format(
+        'FAIL' if errors else 'OK', *map(os.path.abspath, (filename, output_path)), blks_count - len(errors),
+        blks_count, elapsed))
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    mp.freeze_support()
+    main()
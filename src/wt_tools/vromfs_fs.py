@@ -0,0 +1,286 @@
+"""
+Read only file system over several .vromfs.bin images, the way the game mounts them.
+
+Images are mounted in priority order: a file of the first image hides the same file of the next ones. Files are read in
+place, unpacked blks and nm are kept in a LRU cache bounded by size.
+
+>>> with VromfsFS(['char.vromfs.bin', 'aces.vromfs.bin']) as fs:
+...     fs.listdir('gamedata/units')
+...     bs = fs.read_bytes('gamedata/units/tankmodels/fr_b1_ter.blk')
+"""
+
+from collections import OrderedDict
+import errno
+import io
+import os
+import re
+import threading
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Optional, Pattern, Sequence, Set, Tuple, Union
+import zstandard as zstd
+
+try:
+    from formats.vromfs_image import VromfsImage, VromfsEntry, IndexCache, index_key
+    from vromfs_unpacker import get_content, get_decompressor, needs_decompressor, normalize_name
+except ImportError:
+    from wt_tools.formats.vromfs_image import VromfsImage, VromfsEntry, IndexCache, index_key
+    from wt_tools.vromfs_unpacker import get_content, get_decompressor, needs_decompressor, normalize_name
+
+Path = Union[str, os.PathLike]
+
+DEFAULT_CACHE_SIZE = 64 * 2**20
+
+
+class LRUCache:
+    """
+    Least recently used values, bounded by the sum of their sizes.
+    A value larger than the bound is not kept.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self._items: 'OrderedDict[Hashable, bytes]' = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: bytes):
+        if len(value) > self.max_size:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._items[key] = value
+        self.size += len(value)
+        while self.size > self.max_size:
+            _, old = self._items.popitem(last=False)
+            self.size -= len(old)
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+
+class VromfsStat(NamedTuple):
+    st_size: int
+    st_mtime: float
+    image: str
+    packed_size: int
+
+
+def _translate_segment(segment: str) -> str:
+    """Regex for one glob path segment: *, ? and [...] do not match the separator."""
+
+    i, n = 0, len(segment)
+    out = []
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = segment.find(']', i + 1 if segment[i:i + 1] in ('!', ']') else i)
+            if j < 0:
+                out.append(re.escape(c))
+            else:
+                body = segment[i:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[{}]'.format(body.replace('\\', '\\\\')))
+                i = j + 1
+        else:
+            out.append(re.escape(c))
+    return ''.join(out)
+
+
+def glob_regex(pattern: str) -> Pattern:
+    """
+    Compile pathlib like glob pattern for file paths: ** matches any number of directories.
+    """
+
+    segments = normalize_name(pattern.replace('\\', '/')).split('/')
+    parts = []
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == '**':
+            parts.append('.*' if last else '(?:[^/]+/)*')
+        else:
+            parts.append(_translate_segment(segment) + ('' if last else '/'))
+    return re.compile(''.join(parts) + r'\Z', re.DOTALL)
+
+
+class VromfsFS:
+    """
+    Read only view of several images, the first image has the highest priority.
+    Paths are relative to the images root, separated by '/'.
+    """
+
+    def __init__(self, paths: Sequence[Path], cache_size: int = DEFAULT_CACHE_SIZE,
+                 index_cache: Optional[Path] = None):
+        """
+        :param paths: paths to .vromfs.bin files in priority order
+        :param cache_size: limit of unpacked blks and nm kept in memory, in bytes
+        :param index_cache: path to directory of decoded tables, see IndexCache
+        """
+
+        self.images: List[VromfsImage] = []
+        self._dctxs: Dict[int, Optional[zstd.ZstdDecompressor]] = {}
+        self._cache = LRUCache(cache_size)
+        self._lock = threading.RLock()
+        cache = IndexCache(index_cache) if index_cache else None
+        try:
+            for path in paths:
+                self.images.append(VromfsImage(path, cache))
+        except Exception:
+            self.close()
+            raise
+
+        self._files: Dict[str, Tuple[int, VromfsEntry]] = {}
+        self._dirs: Dict[str, Set[str]] = {'': set()}
+        for image_index, image in enumerate(self.images):
+            for entry in image:
+                key = self._key(entry.filename)
+                if key in self._files:
+                    continue
+                self._files[key] = image_index, entry
+                self._add_parents(key)
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return index_key(os.fspath(path)).replace('\\', '/').rstrip('/')
+
+    def _add_parents(self, key: str):
+        parent, _, name = key.rpartition('/')
+        while True:
+            children = self._dirs.get(parent)
+            if children is not None:
+                children.add(name)
+                return
+            self._dirs[parent] = {name}
+            if not parent:
+                return
+            parent, _, name = parent.rpartition('/')
+
+    def _entry(self, path: str) -> Tuple[int, VromfsEntry]:
+        key = self._key(path)
+        try:
+            return self._files[key]
+        except KeyError:
+            if key in self._dirs:
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path) from None
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path) from None
+
+    def _decompressor(self, image_index: int) -> Optional[zstd.ZstdDecompressor]:
+        if image_index not in self._dctxs:
+            self._dctxs[image_index] = get_decompressor(self.images[image_index])
+        return self._dctxs[image_index]
+
+    def read_bytes(self, path: str) -> bytes:
+        """Content of the file as vromfs_unpacker writes it: blks and nm are unpacked."""
+
+        image_index, entry = self._entry(path)
+        if not needs_decompressor(entry):
+            return bytes(get_content(entry, None))
+
+        cache_key = image_index, entry.index
+        with self._lock:
+            bs = self._cache.get(cache_key)
+            if bs is None:
+                bs = bytes(get_content(entry, self._decompressor(image_index)))
+                self._cache.put(cache_key, bs)
+        return bs
+
+    def read_text(self, path: str, encoding: str = 'utf8') -> str:
+        return self.read_bytes(path).decode(encoding)
+
+    def open(self, path: str, mode: str = 'rb', encoding: Optional[str] = None):
+        """Open the file for reading, mode is 'rb' or 'r'."""
+
+        if mode not in ('r', 'rb'):
+            raise ValueError("Read only file system, invalid mode: {!r}".format(mode))
+        f = io.BytesIO(self.read_bytes(path))
+        if mode == 'r':
+            return io.TextIOWrapper(f, encoding=encoding or 'utf8')
+        return f
+
+    def exists(self, path: str) -> bool:
+        key = self._key(path)
+        return key in self._files or key in self._dirs
+
+    def is_file(self, path: str) -> bool:
+        return self._key(path) in self._files
+
+    def is_dir(self, path: str) -> bool:
+        return self._key(path) in self._dirs
+
+    def listdir(self, path: str = '') -> List[str]:
+        key = self._key(path)
+        try:
+            return sorted(self._dirs[key])
+        except KeyError:
+            if key in self._files:
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path) from None
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path) from None
+
+    def walk(self, path: str = '') -> Iterable[Tuple[str, List[str], List[str]]]:
+        """The same as os.walk, top down."""
+
+        key = self._key(path)
+        if key not in self._dirs:
+            return
+        dirs, files = [], []
+        for name in sorted(self._dirs[key]):
+            child = key + '/' + name if key else name
+            (dirs if child in self._dirs else files).append(name)
+        yield key, dirs, files
+        for name in dirs:
+            yield from self.walk(key + '/' + name if key else name)
+
+    def glob(self, pattern: str) -> List[str]:
+        """Paths of files matching the pattern, like 'gamedata/units/**/*.blk'."""
+
+        regex = glob_regex(os.path.normcase(pattern))
+        return sorted(key for key in self._files if regex.match(key))
+
+    def stat(self, path: str) -> VromfsStat:
+        """
+        st_size is the size of the file as read_bytes returns it, so blks and nm are unpacked;
+        st_mtime is the modification time of the image.
+        """
+
+        image_index, entry = self._entry(path)
+        image = self.images[image_index]
+        if needs_decompressor(entry) or os.path.splitext(entry.filename)[1] == '.blk':
+            size = len(self.read_bytes(path))
+        else:
+            size = entry.file_data_size
+        return VromfsStat(size, os.path.getmtime(image.path), os.fspath(image.path), entry.file_data_size)
+
+    def image_of(self, path: str) -> str:
+        """Path to the image the file is read from."""
+
+        image_index, _ = self._entry(path)
+        return os.fspath(self.images[image_index].path)
+
+    def close(self):
+        self._cache.clear()
+        for image in self.images:
+            image.close()
+        self.images = []
+
+    def __enter__(self) -> 'VromfsFS':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,17 +1,28 @@
 import errno
 from enum import IntEnum
+import hashlib
 import json
+import multiprocessing
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import io
 from operator import attrgetter
-from hashlib import md5
-from typing import AnyStr, Optional, Sequence, Union
+import threading
+import time
+from typing import AnyStr, List, NamedTuple, Optional, Sequence, TextIO, Tuple, Union
 import click
 import zstandard as zstd
 try:
-    from formats.vromfs_parser import vromfs_file
+    import xxhash
 except ImportError:
-    from wt_tools.formats.vromfs_parser import vromfs_file
+    xxhash = None
+try:
+    from formats.vromfs_image import VromfsImage, IndexCache
+    from progress import progressbar
+except ImportError:
+    from wt_tools.formats.vromfs_image import VromfsImage, IndexCache
+    from wt_tools.progress import progressbar
 
 
 class BlkType(IntEnum):
@@ -34,7 +45,43 @@ def mkdir_p(path):
             raise
 
 
-MAX_OUTPUT_SIZE = 5_000_000
+MANIFEST_VERSION = 1
+
+# initial size of the per thread output buffer for frames without content size, it grows with the largest of them
+OUTPUT_BUFFER_SIZE = 1 << 20
+# larger buffers are not kept between calls
+MAX_KEPT_BUFFER_SIZE = 1 << 26
+
+_output_buffers = threading.local()
+
+
+def decompress(dctx: zstd.ZstdDecompressor, data) -> bytes:
+    """
+    Decompress one zstd frame of any size.
+
+    The output is allocated once when the frame has content size, otherwise the frame is streamed into a reused
+    per thread buffer.
+    """
+
+    if zstd.frame_content_size(data) >= 0:
+        return dctx.decompress(data)
+
+    buffer: Optional[bytearray] = getattr(_output_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = bytearray(OUTPUT_BUFFER_SIZE)
+    pos = 0
+    with dctx.stream_reader(data) as reader:
+        while True:
+            if pos == len(buffer):
+                buffer.extend(bytes(len(buffer)))
+            with memoryview(buffer) as view:
+                n = reader.readinto(view[pos:])
+            if not n:
+                break
+            pos += n
+    if len(buffer) <= MAX_KEPT_BUFFER_SIZE:
+        _output_buffers.buffer = buffer
+    return bytes(memoryview(buffer)[:pos])
 
 
 def get_blk_content(node, dctx: Optional[zstd.ZstdDecompressor]) -> bytes:
@@ -50,14 +97,14 @@ def get_blk_content(node, dctx: Optional[zstd.ZstdDecompressor]) -> bytes:
         elif pk_type == BlkType.FAT_ZSTD:
             pk_size = int.from_bytes(node.data[1:4], byteorder='little')
             pk_offset = 4
-            decoded = dctx.decompress(node.data[pk_offset:pk_offset+pk_size], max_output_size=MAX_OUTPUT_SIZE)
+            decoded = decompress(dctx, node.data[pk_offset:pk_offset+pk_size])
             bs = decoded[1:]
         elif pk_type == BlkType.SLIM:
             bs = node.data[1:]
         elif pk_type == BlkType.SLIM_ZSTD:
-            bs = dctx.decompress(node.data[1:], max_output_size=MAX_OUTPUT_SIZE)
+            bs = decompress(dctx, node.data[1:])
         elif pk_type == BlkType.SLIM_SZTD_DICT:
-            bs = dctx.decompress(node.data[1:], max_output_size=MAX_OUTPUT_SIZE)
+            bs = decompress(dctx, node.data[1:])
         else:
             bs = node.data
 
@@ -66,7 +113,7 @@ def get_blk_content(node, dctx: Optional[zstd.ZstdDecompressor]) -> bytes:
 
 def get_shared_names_content(node, dctx: zstd.ZstdDecompressor) -> bytes:
     pk_offset = 40
-    return dctx.decompress(node.data[pk_offset:], max_output_size=MAX_OUTPUT_SIZE)
+    return decompress(dctx, node.data[pk_offset:])
 
 
 def get_dict_name(node) -> Optional[str]:
@@ -82,6 +129,55 @@ def normalize_name(name: str) -> str:
     return name.lstrip('/\\')
 
 
+def has_shared_names(image: VromfsImage) -> bool:
+    return bool(image.entries) and image.entries[-1].filename == 'nm'
+
+
+def get_zstd_dict(image: VromfsImage) -> Optional[zstd.ZstdCompressionDict]:
+    """
+    Dictionary for the packed blks of the image, None if they are packed without dictionary.
+    Touches only nm and dictionary entries.
+    """
+
+    if not has_shared_names(image):
+        return None
+
+    dict_name = get_dict_name(image.entries[-1])
+    if not dict_name:
+        return None
+    return zstd.ZstdCompressionDict(bytes(image.find(dict_name).data), dict_type=zstd.DICT_TYPE_AUTO)
+
+
+def make_decompressor(zstd_dict: Optional[zstd.ZstdCompressionDict]) -> zstd.ZstdDecompressor:
+    if zstd_dict:
+        return zstd.ZstdDecompressor(dict_data=zstd_dict, format=zstd.FORMAT_ZSTD1)
+    return zstd.ZstdDecompressor(format=zstd.FORMAT_ZSTD1)
+
+
+def get_decompressor(image: VromfsImage) -> Optional[zstd.ZstdDecompressor]:
+    """
+    Decompressor for the packed blks and the shared names of the image, None if the image has no shared names.
+    """
+
+    if not has_shared_names(image):
+        return None
+    return make_decompressor(get_zstd_dict(image))
+
+
+def get_content(node, dctx: Optional[zstd.ZstdDecompressor]) -> bytes:
+    """
+    Content of the entry as it is written by unpack: shared names and blks are unpacked, other files are copied.
+    """
+
+    name = normalize_name(node.filename)
+    if os.path.basename(name) == 'nm':
+        return get_shared_names_content(node, dctx)
+    elif name.endswith('.blk'):
+        return get_blk_content(node, dctx)
+    else:
+        return node.data
+
+
 get_name = attrgetter("filename")
 get_data = attrgetter("data")
 
@@ -89,116 +185,417 @@ get_data = attrgetter("data")
 Path = Union[AnyStr, os.PathLike]
 
 
-def unpack(filename: Path, dest_dir: Path, file_list_path: Optional[Path] = None) -> Sequence[str]:
+def write_entry(entry, dest_dir: Path, dctx: Optional[zstd.ZstdDecompressor]) -> Optional[str]:
+    """
+    Write content of the entry into dest_dir.
+
+    :return internal name if something has been written
+    """
+
+    # clean leading slashes, there was a bug in 1.99.1.70 with "/version" file path
+    internal_file_path = normalize_name(entry.filename)
+    unpacked_filename = os.path.join(dest_dir, internal_file_path)
+    mkdir_p(unpacked_filename)
+    with open(unpacked_filename, 'wb') as f:
+        bs = get_content(entry, dctx)
+        if bs:
+            f.write(bs)
+            return internal_file_path
+    return None
+
+
+def load_file_list(file_list_path: Optional[Path]) -> Optional[Sequence[str]]:
+    if not file_list_path:
+        return None
+
+    with open(file_list_path) as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            msg = "[FAIL] Load the file list from {}: {}".format(os.path.abspath(file_list_path), e)
+            print(msg, file=sys.stderr)
+            sys.exit(1)
+
+
+def manifest_path(dest_dir: Path) -> str:
+    return os.path.normpath(dest_dir) + '.manifest.json'
+
+
+def load_manifest(path: Path) -> dict:
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def save_manifest(path: Path, manifest: dict):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def remove_file(dest_dir: Path, internal_file_path: str):
+    """Remove unpacked file and its directories left empty, dest_dir is kept."""
+
+    path = os.path.join(dest_dir, internal_file_path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    root = os.path.abspath(dest_dir)
+    dir_path = os.path.dirname(os.path.abspath(path))
+    while dir_path != root and os.path.commonpath((dir_path, root)) == root:
+        try:
+            os.rmdir(dir_path)
+        except OSError:
+            break
+        dir_path = os.path.dirname(dir_path)
+
+
+def select_changed(image: VromfsImage, dest_dir: Path, manifest: dict) -> Tuple[Sequence, Sequence[str], dict]:
+    """
+    Compare entries of the image with manifest of the previous unpacking.
+
+    :return entries to write, internal names to remove, new manifest
+    """
+
+    dict_name = get_dict_name(image.entries[-1]) if has_shared_names(image) else None
+    old_files = manifest.get('files', {})
+    # other dictionary changes content of every packed blk, all files are written anew
+    same_dict = manifest.get('dict') == dict_name
+    files = {}
+    changed = []
+    for entry in image.entries:
+        internal_file_path = normalize_name(entry.filename)
+        record = {'size': entry.file_data_size, 'hash': entry.hexdigest}
+        files[internal_file_path] = record
+        if not same_dict or old_files.get(internal_file_path) != record or \
+                not os.path.isfile(os.path.join(dest_dir, internal_file_path)):
+            changed.append(entry)
+
+    removed = [name for name in old_files if name not in files]
+    return changed, removed, {'version': MANIFEST_VERSION, 'dict': dict_name, 'files': files}
+
+
+def open_image(filename: Path, index_cache: Optional[Path] = None) -> VromfsImage:
+    """
+    :param filename: path to .vromfs.bin file
+    :param index_cache: path to directory of decoded tables, see IndexCache
+    """
+
+    return VromfsImage(filename, IndexCache(index_cache) if index_cache else None)
+
+
+def unpack(filename: Path, dest_dir: Path, file_list_path: Optional[Path] = None, jobs: int = 1,
+           quiet: bool = False, incremental: bool = False, index_cache: Optional[Path] = None) -> Sequence[str]:
     """
     Unpack files from .vromfs.bin
 
     :param filename: path to .vromfs.bin file
     :param dest_dir: path to output dir
     :param file_list_path: path to file list, if you want to unpack only few files, in json list.
+    :param jobs: number of threads to decompress and write files
+    :param quiet: do not show progress and result
+    :param incremental: write only files changed since the previous unpacking into dest_dir and remove files
+        missing in the image, the state is kept in dest_dir.manifest.json
+    :param index_cache: path to directory of decoded tables
     :return internal names that have been written
     """
 
-    if file_list_path:
-        with open(file_list_path) as f:
-            try:
-                file_list = json.load(f)
-            except json.JSONDecodeError as e:
-                msg = "[FAIL] Load the file list from {}: {}".format(os.path.abspath(file_list_path), e)
-                print(msg, file=sys.stderr)
-                sys.exit(1)
-
-        file_list = [os.path.normcase(p) for p in file_list]
-    else:
-        file_list = None
+    if incremental and file_list_path:
+        raise ValueError("Incremental unpacking works with the whole image only")
 
+    file_list = load_file_list(file_list_path)
     if file_list == []:
         print("[WARN] Nothing to do: the file list is empty.")
         return ()
 
-    with open(filename, 'rb') as f:
-        data = f.read()
-    parsed = vromfs_file.parse(data)
-
-    names_ns = parsed.body.data.data.filename_table.filenames
-    files_count = len(names_ns)
-    data_ns = parsed.body.data.data.file_data_table.file_data_list
-    nm_id = files_count - 1
-    is_namemap_here = names_ns[nm_id].filename == 'nm'
-
-    if is_namemap_here:
-        dict_name = get_dict_name(data_ns[nm_id])
-        if dict_name:
-            dict_id = None
-            for i, ns in enumerate(names_ns):
-                if ns.filename == dict_name:
-                    dict_id = i
-                    break
-            zstd_dict = zstd.ZstdCompressionDict(data_ns[dict_id].data, dict_type=zstd.DICT_TYPE_AUTO)
-            dctx = zstd.ZstdDecompressor(dict_data=zstd_dict, format=zstd.FORMAT_ZSTD1)
+    with open_image(filename, index_cache) as image:
+        if incremental:
+            manifest_path_ = manifest_path(dest_dir)
+            entries, removed_names, manifest = select_changed(image, dest_dir, load_manifest(manifest_path_))
+            for name in removed_names:
+                remove_file(dest_dir, name)
+        elif file_list is None:
+            entries = image.entries
         else:
-            dctx = zstd.ZstdDecompressor(format=zstd.FORMAT_ZSTD1)
-    else:
-        dctx = None
-
-    written_names = []
+            found = (image.find(name) for name in file_list)
+            entries = sorted(set(filter(None, found)), key=attrgetter('index'))
 
-    with click.progressbar(range(files_count), label="Unpacking files") as bar:
-        for i in bar:
-            # clean leading slashes, there was a bug in 1.99.1.70 with "/version" file path
-            internal_file_path = normalize_name(names_ns[i].filename)
+        if jobs > 1:
+            names = unpack_entries_mt(image, entries, dest_dir, jobs, quiet)
+        else:
+            dctx = get_decompressor(image)
+            with progressbar(quiet, entries, label="Unpacking files") as bar:
+                names = [write_entry(entry, dest_dir, dctx) for entry in bar]
 
-            if (file_list is None) or (os.path.normcase(internal_file_path) in file_list):
-                unpacked_filename = os.path.join(dest_dir, internal_file_path)
-                mkdir_p(unpacked_filename)
-                with open(unpacked_filename, 'wb') as f:
-                    if os.path.basename(unpacked_filename) == 'nm':
-                        bs = get_shared_names_content(data_ns[i], dctx)
-                    elif unpacked_filename.endswith('.blk'):
-                        bs = get_blk_content(data_ns[i], dctx)
-                    else:
-                        bs = data_ns[i].data
+        written_names = [name for name in names if name]
 
-                    if bs:
-                        f.write(bs)
-                        written_names.append(internal_file_path)
+    if incremental:
+        os.makedirs(dest_dir, exist_ok=True)
+        save_manifest(manifest_path_, manifest)
 
-    print("[OK] {} => {}".format(*map(os.path.abspath, (filename, dest_dir))))
+    if not quiet:
+        print("[OK] {} => {}".format(*map(os.path.abspath, (filename, dest_dir))))
+        if incremental:
+            print("{} changed, {} unchanged, {} removed".format(
+                len(entries), len(manifest['files']) - len(entries), len(removed_names)))
 
     return tuple(written_names)
 
 
-def files_list_info(filename: Path, dest_file: Optional[Path] = None) -> Optional[str]:
-    with open(filename, 'rb') as f:
-        data = f.read()
-    parsed = vromfs_file.parse(data)
-    names_ns = parsed.body.data.data.filename_table.filenames
-    data_ns = parsed.body.data.data.file_data_table.file_data_list
-    out_list = []
+def unpack_entries_mt(image: VromfsImage, entries: Sequence, dest_dir: Path, jobs: int,
+                      quiet: bool = False) -> Sequence[Optional[str]]:
+    """
+    Write entries with a pool of threads: zstd and file writes release GIL.
+    Every thread has own decompressor, the dictionary is shared.
+
+    :return results of write_entry in order of entries
+    """
+
+    shared_names = has_shared_names(image)
+    zstd_dict = get_zstd_dict(image)
+    local = threading.local()
+
+    def write(entry) -> Optional[str]:
+        dctx = getattr(local, 'dctx', None)
+        if dctx is None and shared_names:
+            dctx = local.dctx = make_decompressor(zstd_dict)
+        return write_entry(entry, dest_dir, dctx)
+
+    names = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        with progressbar(quiet, length=len(entries), label="Unpacking files") as bar:
+            for name in executor.map(write, entries):
+                names.append(name)
+                bar.update(1)
+    return names
+
+
+class UnpackResult(NamedTuple):
+    filename: str
+    dest_dir: str
+    files_count: int
+    elapsed: float
+    error: Optional[str]
 
-    for name, data in zip(map(get_name, names_ns), map(get_data, data_ns)):
-        m = md5(data).hexdigest()
-        out_list.append({"filename": os.path.normcase(name), "hash": m})
 
-    out_json = json.dumps({'version': 1, 'filelist': out_list})
-    if not dest_file:
-        return out_json
+def _unpack_image(filename: Path, dest_dir: Path, file_list_path: Optional[Path], jobs: int,
+                  incremental: bool, index_cache: Optional[Path]) -> UnpackResult:
+    start = time.perf_counter()
+    try:
+        written_names = unpack(filename, dest_dir, file_list_path, jobs, quiet=True, incremental=incremental,
+                               index_cache=index_cache)
+        error = None
+    except Exception as e:
+        written_names = ()
+        error = '{}: {}'.format(type(e).__name__, e)
+    return UnpackResult(os.fspath(filename), os.fspath(dest_dir), len(written_names), time.perf_counter() - start,
+                        error)
+
+
+def find_images(path: Path) -> Sequence[str]:
+    """Path itself if it is a file, all .vromfs.bin files under it if it is a directory."""
+
+    if not os.path.isdir(path):
+        return [os.fspath(path)]
+    images = []
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            if name.endswith('.vromfs.bin'):
+                images.append(os.path.join(root, name))
+    return sorted(images)
+
+
+def unpack_batch(images: Sequence[Tuple[Path, Path]], file_list_path: Optional[Path] = None,
+                 processes: Optional[int] = None, jobs: int = 1, incremental: bool = False,
+                 index_cache: Optional[Path] = None) -> Sequence[UnpackResult]:
+    """
+    Unpack several .vromfs.bin files with a pool of processes, largest image first.
+
+    :param images: pairs of path to .vromfs.bin file and path to its output dir
+    :param file_list_path: path to file list, applied to every image
+    :param processes: number of processes, by default number of CPUs
+    :param jobs: number of threads per image
+    :param incremental: see unpack
+    :param index_cache: path to directory of decoded tables
+    :return results in order of images
+    """
+
+    # fail before scheduling, not in every worker
+    load_file_list(file_list_path)
+
+    sizes = [os.path.getsize(filename) for filename, _ in images]
+    order = sorted(range(len(images)), key=sizes.__getitem__, reverse=True)
+    results: List[Optional[UnpackResult]] = [None] * len(images)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(_unpack_image, *images[i], file_list_path, jobs, incremental, index_cache): i
+                   for i in order}
+        with click.progressbar(length=sum(sizes), label="Unpacking images") as bar:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                bar.update(sizes[i])
+
+    return results
+
+
+def needs_decompressor(entry) -> bool:
+    name = normalize_name(entry.filename)
+    if os.path.basename(name) == 'nm':
+        return True
+    return name.endswith('.blk') and entry.file_data_size > 0 and \
+        entry.data[0] in (BlkType.FAT_ZSTD, BlkType.SLIM_ZSTD, BlkType.SLIM_SZTD_DICT)
+
+
+def read_file(filename: Path, internal_path: str, index_cache: Optional[Path] = None) -> bytes:
+    """
+    Read one file from .vromfs.bin, the way unpack writes it, without touching other files.
+
+    :param filename: path to .vromfs.bin file
+    :param internal_path: path of the file in the image
+    :param index_cache: path to directory of decoded tables
+    :return content of the file
+    :raise KeyError: if the file is not in the image
+    """
+
+    with open_image(filename, index_cache) as image:
+        entry = image.find(internal_path)
+        if entry is None:
+            raise KeyError(internal_path)
+        # the dictionary and nm are the last entries, do not touch them for plain files
+        dctx = get_decompressor(image) if needs_decompressor(entry) else None
+        return bytes(get_content(entry, dctx))
+
+
+HASHES = {
+    'md5': hashlib.md5,
+    'blake2b': hashlib.blake2b,
+}
+if xxhash:
+    HASHES['xxh3'] = xxhash.xxh3_64
+
+
+def entry_hexdigest(entry, hash_name: str = 'md5') -> str:
+    if hash_name == 'md5':
+        # may be taken from the index cache
+        return entry.hexdigest
+    return HASHES[hash_name](entry.data).hexdigest()
+
+
+def write_files_list_info(image: VromfsImage, f: TextIO, hash_name: str = 'md5', jobs: int = 1, jsonl: bool = False):
+    """
+    Write names and hashes of entries as they are computed.
+
+    :param image: vromfs image
+    :param f: text stream
+    :param hash_name: one of HASHES
+    :param jobs: number of threads to hash entries with, hashlib releases GIL for large data
+    :param jsonl: write json line per entry instead of {'version': 1, 'filelist': [...]} document
+    """
+
+    def item(entry) -> str:
+        return json.dumps({"filename": os.path.normcase(entry.filename), "hash": entry_hexdigest(entry, hash_name)})
+
+    if jobs > 1:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        items = executor.map(item, image.entries)
     else:
+        executor = None
+        items = map(item, image.entries)
+
+    try:
+        if jsonl:
+            for line in items:
+                f.write(line)
+                f.write('\n')
+        else:
+            # the same text as json.dumps({'version': 1, 'filelist': [...]})
+            f.write('{"version": 1, "filelist": [')
+            for i, line in enumerate(items):
+                if i:
+                    f.write(', ')
+                f.write(line)
+            f.write(']}')
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def files_list_info(filename: Path, dest_file: Optional[Path] = None, index_cache: Optional[Path] = None,
+                    hash_name: str = 'md5', jobs: int = 1, jsonl: bool = False) -> Optional[str]:
+    """
+    Metadata of .vromfs.bin: names and hashes of files.
+
+    :param filename: path to .vromfs.bin file
+    :param dest_file: path to output file, if omitted the metadata is returned
+    :param index_cache: path to directory of decoded tables
+    :param hash_name: one of HASHES
+    :param jobs: number of threads to hash files with
+    :param jsonl: json line per file instead of one document
+    """
+
+    with open_image(filename, index_cache) as image:
+        if not dest_file:
+            f = io.StringIO()
+            write_files_list_info(image, f, hash_name, jobs, jsonl)
+            return f.getvalue()
+
         with open(dest_file, 'w') as f:
-            f.write(out_json)
-        print("[OK] {} => {}".format(*map(os.path.abspath, (filename, dest_file))))
+            write_files_list_info(image, f, hash_name, jobs, jsonl)
+    print("[OK] {} => {}".format(*map(os.path.abspath, (filename, dest_file))))
 
 
-@click.command()
-@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+class DefaultCommandGroup(click.Group):
+    """
+    Runs default_command when the first argument is not a command name,
+    so `vromfs_unpacker some.vromfs.bin` keeps working next to `vromfs_unpacker cat ...`.
+    """
+
+    def __init__(self, *args, default_command: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] != '--help':
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup, default_command='unpack')
+def main():
+    """
+    vromfs_unpacker: unpacks vromfs files
+
+    Commands: unpack (default), cat, ls.
+    """
+
+
+@main.command('unpack')
+@click.argument('filenames', metavar='FILENAME...', nargs=-1, required=True, type=click.Path(exists=True))
 @click.option('-O', '--output', 'output_path', type=click.Path(), default=None)
 @click.option('--metadata', 'metadata', is_flag=True, default=False)
 @click.option('--input_filelist', 'input_filelist', type=click.Path(), default=None)
-def main(filename: os.PathLike, output_path: Optional[os.PathLike], metadata: bool, input_filelist: Optional[os.PathLike]):
+@click.option('-j', '--jobs', 'jobs', type=click.IntRange(min=1), default=1, show_default=True)
+@click.option('-p', '--processes', 'processes', type=click.IntRange(min=1), default=None)
+@click.option('--incremental', 'incremental', is_flag=True, default=False)
+@click.option('--index_cache', 'index_cache', type=click.Path(file_okay=False), default=None,
+              envvar='WT_TOOLS_INDEX_CACHE')
+@click.option('--hash', 'hash_name', type=click.Choice(list(HASHES)), default='md5', show_default=True)
+@click.option('--jsonl', 'jsonl', is_flag=True, default=False)
+def unpack_command(filenames: Sequence[str], output_path: Optional[os.PathLike], metadata: bool,
+                   input_filelist: Optional[os.PathLike], jobs: int, processes: Optional[int], incremental: bool,
+                   index_cache: Optional[os.PathLike], hash_name: str, jsonl: bool):
     """
     vromfs_unpacker: unpacks vromfs file into folder
 
-    FILENAME: vromfs file to unpack
+    FILENAME: vromfs file to unpack, several files or directories with vromfs files are unpacked in batch mode
 
     -O, --output: path where to unpack vromfs file, by default is FILENAME with appended _u, like some.vromfs.bin_u
 
@@ -208,18 +605,44 @@ def main(filename: os.PathLike, output_path: Optional[os.PathLike], metadata: bo
     --input_filelist: pass the file with list of files you want to unpack and only this files will be unpacked.
     Files should be a json list format, like: `["buildtstamp", "gamedata/units/tankmodels/fr_b1_ter.blk"]`
 
+    -j, --jobs: number of threads to unpack or hash files of one vromfs file with.
+
+    -p, --processes: number of vromfs files unpacked at once in batch mode, by default number of CPUs.
+
+    --incremental: write only files changed since the previous unpacking into the same folder and remove files that
+    disappeared from vromfs file. The state is kept in a manifest next to the folder, like some.vromfs.bin_u.manifest.json
+
+    --index_cache: folder to keep decoded file tables and hashes of vromfs files in, by default WT_TOOLS_INDEX_CACHE
+    environment variable. With it --metadata, ls and cat do not unpack the whole vromfs file the next time.
+
+    --hash: hash of files for --metadata: md5, blake2b or xxh3 if xxhash package is installed.
+
+    --jsonl: print --metadata as json line per file: filename, hash.
+
     example: `vromfs_unpacker some.vromfs.bin` will unpack content to some.vromfs.bin_u folder. If you want to unpack to
     custom folder, use `vromfs_unpacker some.vromfs.bin --output my_folder`, that will unpack some.vromfs.bin folder to
     my_folder. If you want to get only file metadata, use `vromfs_unpacker some.vromfs.bin --metadata`. If you want to
     unpack only few selected manually files, place json list of files in file, and use
-    `vromfs_unpacker some.vromfs.bin --input_filelist my_filelist.txt`
+    `vromfs_unpacker some.vromfs.bin --input_filelist my_filelist.txt`. To unpack all vromfs files of the game use
+    `vromfs_unpacker ~/games/WarThunder --output my_folder`.
     """
+    is_batch = len(filenames) > 1 or os.path.isdir(filenames[0])
+    if incremental and input_filelist:
+        raise click.UsageError("--incremental can not be used with --input_filelist")
+
     if metadata:
+        if is_batch:
+            raise click.UsageError("--metadata expects one vromfs file")
+        filename = filenames[0]
         if output_path:
-            files_list_info(filename, dest_file=output_path)
+            files_list_info(filename, output_path, index_cache, hash_name, jobs, jsonl)
         else:
-            print(files_list_info(filename, dest_file=None))
-    else:
+            with open_image(filename, index_cache) as image:
+                write_files_list_info(image, sys.stdout, hash_name, jobs, jsonl)
+            if not jsonl:
+                print()
+    elif not is_batch:
+        filename = filenames[0]
         # unpack into output_folder/some.vromfs.bin folder
         if output_path:
             output_path = os.path.join(output_path, os.path.basename(filename))
@@ -227,8 +650,97 @@ def main(filename: os.PathLike, output_path: Optional[os.PathLike], metadata: bo
         else:
             head, tail = os.path.split(filename)
             output_path = os.path.join(head, tail + '_u')
-        unpack(filename, output_path, input_filelist)
+        unpack(filename, output_path, input_filelist, jobs, incremental=incremental, index_cache=index_cache)
+    else:
+        images = []
+        for path in filenames:
+            for filename in find_images(path):
+                if not output_path:
+                    dest_dir = filename + '_u'
+                elif filename == path:
+                    dest_dir = os.path.join(output_path, os.path.basename(filename))
+                else:
+                    # keep layout of the directory: output_folder/some_dir/some.vromfs.bin
+                    dest_dir = os.path.join(output_path, os.path.relpath(filename, path))
+                images.append((filename, dest_dir))
+
+        if not images:
+            print("[WARN] Nothing to do: no vromfs files found.")
+            return
+
+        start = time.perf_counter()
+        results = unpack_batch(images, input_filelist, processes, jobs, incremental, index_cache)
+        elapsed = time.perf_counter() - start
+
+        failed = [result for result in results if result.error]
+        for result in failed:
+            print("[FAIL] {}: {}".format(os.path.abspath(result.filename), result.error), file=sys.stderr)
+        print("[{}] {} of {} images, {} files in {:.1f} s".format(
+            'FAIL' if failed else 'OK', len(results) - len(failed), len(results),
+            sum(result.files_count for result in results), elapsed))
+        if failed:
+            sys.exit(1)
+
+
+@main.command('cat')
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.argument('internal_path')
+@click.option('-O', '--output', 'output_path', type=click.Path(dir_okay=False), default=None)
+@click.option('--index_cache', 'index_cache', type=click.Path(file_okay=False), default=None,
+              envvar='WT_TOOLS_INDEX_CACHE')
+def cat_command(filename: os.PathLike, internal_path: str, output_path: Optional[os.PathLike],
+                index_cache: Optional[os.PathLike]):
+    """
+    vromfs_unpacker cat: prints one file from vromfs file
+
+    FILENAME: vromfs file
+
+    INTERNAL_PATH: path of the file in vromfs file, like gamedata/units/tankmodels/fr_b1_ter.blk
+
+    -O, --output: write the file here instead of stdout
+
+    --index_cache: folder to keep decoded file tables in, by default WT_TOOLS_INDEX_CACHE environment variable
+
+    example: `vromfs_unpacker cat char.vromfs.bin gamedata/units/tankmodels/fr_b1_ter.blk -O fr_b1_ter.blk`
+    """
+    try:
+        bs = read_file(filename, internal_path, index_cache)
+    except KeyError:
+        print("[FAIL] {} not found in {}".format(internal_path, os.path.abspath(filename)), file=sys.stderr)
+        sys.exit(1)
+
+    if output_path:
+        with open(output_path, 'wb') as f:
+            f.write(bs)
+    else:
+        click.get_binary_stream('stdout').write(bs)
+
+
+@main.command('ls')
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('-l', 'long', is_flag=True, default=False)
+@click.option('--index_cache', 'index_cache', type=click.Path(file_okay=False), default=None,
+              envvar='WT_TOOLS_INDEX_CACHE')
+def ls_command(filename: os.PathLike, long: bool, index_cache: Optional[os.PathLike]):
+    """
+    vromfs_unpacker ls: prints names of files in vromfs file
+
+    FILENAME: vromfs file
+
+    -l: print size and md5 hash of packed data before the name
+
+    --index_cache: folder to keep decoded file tables in, by default WT_TOOLS_INDEX_CACHE environment variable
+
+    example: `vromfs_unpacker ls char.vromfs.bin`
+    """
+    with open_image(filename, index_cache) as image:
+        for entry in image:
+            if long:
+                print("{:>10} {} {}".format(entry.file_data_size, entry.hexdigest, entry.filename))
+            else:
+                print(entry.filename)
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,41 @@
+"""
+Построение синтетических текстур .ddsx и пакетов .dxp.bin для тестов.
+"""
+
+import struct
+import typing as t
+
+FLG_REV_MIP_ORDER = 0x40000
+
+
+def make_ddsx(body: bytes, packed_type: int, packed: t.Optional[bytes] = None, flags: int = 0, w: int = 4, h: int = 4,
+              levels: int = 1, d3d_format: bytes = b'DXT1') -> bytes:
+    """Текстура: заголовок 0x20 байт и данные, packed_type - байт 0xb."""
+
+    flags |= packed_type << 24
+    packed_size = len(packed) if packed is not None else 0
+    header = struct.pack('<4s4sIHHBBHH2sII', b'DDSx', d3d_format, flags, w, h, levels, 0, 1, 0, b'\x00\x00',
+                         len(body), packed_size)
+    return header + (packed if packed is not None else body)
+
+
+def make_dxp(textures: t.Sequence[t.Tuple[str, bytes]]) -> bytes:
+    """Пакет: имена, таблица заголовков текстур и их данные, как их читает dxp_unpack."""
+
+    names = b''.join(name.encode('utf8') + b'\x00' for name, _ in textures)
+    dds_offset = 0x48 + len(names)
+    block_3_offset = dds_offset + 0x20 * len(textures)
+    data_offset = block_3_offset + 0x18 * len(textures)
+
+    header = bytearray(0x48)
+    header[:4] = b'DxP2'
+    struct.pack_into('H', header, 0x8, len(textures))
+    struct.pack_into('I', header, 0x20, dds_offset - 0x10)
+    struct.pack_into('I', header, 0x30, block_3_offset - 0x10)
+
+    block_3 = bytearray()
+    data = bytearray()
+    for _, ddsx in textures:
+        block_3 += struct.pack('<12xII4x', data_offset + len(data), len(ddsx) - 0x20)
+        data += ddsx[0x20:]
+    return bytes(header + names + b''.join(ddsx[:0x20] for _, ddsx in textures) + block_3 + data)
@@ -0,0 +1,107 @@
+"""
+Построение синтетических образов .vromfs.bin для тестов.
+"""
+
+from hashlib import md5
+import struct
+import typing as t
+import zstandard as zstd
+
+NOT_PACKED = 'not_packed'
+ZSTD_PACKED = 'zstd_packed'
+ZSTD_PACKED_NOCHECK = 'zstd_packed_nocheck'
+
+_types = {
+    NOT_PACKED: 0x20,
+    ZSTD_PACKED: 0x30,
+    ZSTD_PACKED_NOCHECK: 0x10,
+}
+
+_key16 = (0xAA55AA55, 0xF00FF00F, 0xAA55AA55, 0x12481248)
+_key32 = (0x12481248, 0xAA55AA55, 0xF00FF00F, 0xAA55AA55)
+
+
+def _align(n: int, k: int = 16) -> int:
+    return (n + k - 1) // k * k
+
+
+def _xor16(bs: bytearray, offset: int, key: t.Sequence[int]):
+    xs = struct.unpack_from('<4L', bs, offset)
+    struct.pack_into('<4L', bs, offset, *(x ^ y for x, y in zip(xs, key)))
+
+
+def build_body(files: t.Sequence[t.Tuple[str, bytes]]) -> bytes:
+    """Тело образа: таблица имен, таблица данных, данные."""
+
+    count = len(files)
+    names = [(b'\xff?nm' if name == 'nm' else name.encode('utf8')) + b'\x00' for name, _ in files]
+    names_table_offset = 0x20
+    names_offset = names_table_offset + count * 8
+    data_table_offset = _align(names_offset + sum(map(len, names)))
+    data_offset = _align(data_table_offset + count * 16)
+
+    body = bytearray(data_offset)
+    struct.pack_into('<II8xI', body, 0, names_table_offset, count, data_table_offset)
+    name_offset = names_offset
+    for i, name in enumerate(names):
+        struct.pack_into('<Q', body, names_table_offset + i * 8, name_offset)
+        body[name_offset:name_offset + len(name)] = name
+        name_offset += len(name)
+
+    for i, (_, data) in enumerate(files):
+        offset = len(body)
+        struct.pack_into('<II8x', body, data_table_offset + i * 16, offset, len(data))
+        body += data
+        body += b'\x00' * (_align(len(body)) - len(body))
+
+    return bytes(body)
+
+
+def obfuscate(bs: bytes) -> bytes:
+    bs = bytearray(bs)
+    size = len(bs)
+    if size >= 16:
+        _xor16(bs, 0, _key16)
+    if size >= 32:
+        _xor16(bs, 16 + (size - 32) // 4 * 4, _key32)
+    return bytes(bs)
+
+
+def build_image(files: t.Sequence[t.Tuple[str, bytes]], packed_type: str = NOT_PACKED,
+                magic: bytes = b'VRFs') -> bytes:
+    """Образ .vromfs.bin из пар (имя, данные)."""
+
+    body = build_body(files)
+    type_ = _types[packed_type]
+    if packed_type == NOT_PACKED:
+        packed = body
+        packed_size = 0
+    else:
+        packed = obfuscate(zstd.ZstdCompressor().compress(body))
+        packed_size = len(packed)
+
+    header = magic + b'\x00\x00PC' + struct.pack('<II', len(body), type_ << 26 | packed_size)
+    if magic == b'VRFx':
+        header += struct.pack('<HHI', 8, 0, 34013242)
+    tail = b'' if packed_type == ZSTD_PACKED_NOCHECK else md5(body).digest()
+    return header + packed + tail
+
+
+def slim_zstd(data: bytes, cctx: t.Optional[zstd.ZstdCompressor] = None) -> bytes:
+    """Содержимое .blk: сжатый zstd blk с общими именами."""
+
+    cctx = cctx or zstd.ZstdCompressor()
+    return b'\x04' + cctx.compress(data)
+
+
+def fat_zstd(data: bytes) -> bytes:
+    """Содержимое .blk: сжатый zstd blk со встроенными именами."""
+
+    packed = zstd.ZstdCompressor().compress(b'\x01' + data)
+    return b'\x02' + len(packed).to_bytes(3, 'little') + packed
+
+
+def names_map(data: bytes, dict_id: bytes = b'\x00' * 32) -> bytes:
+    """Содержимое nm: заголовок, идентификатор словаря, сжатые имена."""
+
+    return b'\x00' * 8 + dict_id + zstd.ZstdCompressor().compress(data)
@@ -1,4 +1,6 @@
-from wt_tools.blk_minify import minify
+import os
+import pytest
+from wt_tools.blk_minify import _type_tags, find_blk_files, iterminify_section, minify, minify_files, MinifyError
 
 strip_options = {
     'strip_empty_objects': False,
@@ -108,3 +110,148 @@ def test_empty_object_with_newlines():
     expected = "some{}"
     actual = minify(data, strip_options)
     assert actual == expected, "zzz"
+
+
+def test_values_in_objects():
+    data = \
+    """
+    a:i=1 // comment
+    o {
+        b:t="x; y}" /* comment */
+        p{ c:p2=1, 2; }
+    }
+    d:b=no
+    """
+    expected = 'a:i=1;o{b:t="x; y}";p{c:p2=1,2;}}d:b=no'
+    actual = minify(data, strip_options)
+    assert actual == expected, "zzz"
+
+
+def test_strip_objects():
+    data = \
+    """
+    a:i=1
+    comment{ text:t="note" }
+    __unitRespawn{ b:i=2 }
+    o{ p{ empty{} } }
+    q{ r:i=3 }
+    """
+    options = {option: True for option in strip_options}
+    expected = "a:i=1;q{r:i=3;}"
+    actual = minify(data, options)
+    assert actual == expected, "zzz"
+
+
+# последнее значение верхнего уровня пишется без ';', прежний преобразователь на Lark ставил ';' и после него
+@pytest.mark.parametrize('data, expected', [
+    ("a:t='q\"';", "a:t='q\"'"),
+    ("a:t='q\"'", "a:t='q\"'"),
+    ('a:i=1\nb:i=2\n', 'a:i=1;b:i=2'),
+    ('o{a:i=1}\nb:r=1', 'o{a:i=1;}b:r=1'),
+    ('o{a:i=1}', 'o{a:i=1;}'),
+])
+def test_last_value_separator(data, expected):
+    assert minify(data, strip_options) == expected
+
+
+@pytest.mark.parametrize('data', ['o{a:i=1', 'a:i=1}', 'a:i=', 'a:t="x', 'a=1'])
+def test_minify_error(data):
+    with pytest.raises(MinifyError):
+        minify(data, strip_options)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_minify_files(tmp_path, jobs):
+    src_path = tmp_path / 'mission'
+    (src_path / 'sub').mkdir(parents=True)
+    (src_path / 'a.blk').write_text('a:i=1\no{ b:i=2 }\n')
+    (src_path / 'sub' / 'b.blk').write_text('c{}\n')
+    (src_path / 'sub' / 'broken.blk').write_text('d{\n')
+    (src_path / 'a.min.blk').write_text('')
+    found = find_blk_files([str(src_path)])
+    assert sorted(rel_path for _, rel_path in found) == ['a.blk', os.path.join('sub', 'b.blk'),
+                                                         os.path.join('sub', 'broken.blk')]
+
+    out_path = tmp_path / 'out'
+    files = [(filename, str(out_path / rel_path)) for filename, rel_path in found]
+    size, out_size, errors = minify_files(files, strip_options, jobs)
+    assert [os.path.basename(filename) for filename, _ in errors] == ['broken.blk']
+    assert (size, out_size) == (21, 18)
+    assert (out_path / 'a.blk').read_text() == 'a:i=1;o{b:i=2;}'
+    assert (out_path / 'sub' / 'b.blk').read_text() == 'c{}'
+    assert not (out_path / 'sub' / 'broken.blk').exists()
+
+
+# значения с именами классов blk.types
+class Int(int):
+    pass
+
+
+class Bool(int):
+    pass
+
+
+class Float(float):
+    pass
+
+
+class Str(str):
+    pass
+
+
+class Float3(tuple):
+    pass
+
+
+class Float12(tuple):
+    pass
+
+
+def test_minify_section():
+    root = {
+        'a': [Int(1), Int(-2)],
+        'name': [Str('x y')],
+        'o': [{
+            'on': [Bool(1)],
+            'pos': [Float3((0.1, 2.0, -3.5))],
+            'tm': [Float12((1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 0.5, 0.25, 0.0))],
+            'empty': [{}],
+            'comment': [{'text': [Str('note')]}],
+        }],
+        '__disabled': [{'b': [Float(0.30000001192092896)]}],
+        'my name': [Float(1e10)],
+    }
+    expected = 'a:i=1;a:i=-2;name:t="x y";o{on:b=yes;pos:p3=0.1,2,-3.5;' \
+               'tm:m=[[1,0,0][0,1,0][0,0,1][0.5,0.25,0]];empty{}comment{text:t="note";}}' \
+               '__disabled{b:r=0.3;}"my name":r=1e+10'
+    actual = ''.join(iterminify_section(root, strip_options))
+    assert actual == expected
+    assert minify(expected, strip_options) == expected
+
+    options = {option: True for option in strip_options}
+    expected = 'a:i=1;a:i=-2;name:t="x y";o{on:b=yes;pos:p3=0.1,2,-3.5;' \
+               'tm:m=[[1,0,0][0,1,0][0,0,1][0.5,0.25,0]];}"my name":r=1e+10'
+    actual = ''.join(iterminify_section(root, options))
+    assert actual == expected
+
+    with pytest.raises(MinifyError):
+        ''.join(iterminify_section({'s': [Str('a"b\'c')]}, strip_options))
+    assert ''.join(iterminify_section({'s': [Str('a"b')]}, strip_options)) == "s:t='a\"b'"
+
+
+def test_minify_section_blk_types():
+    types = pytest.importorskip('blk.types')
+    # тип значения выбирается по имени класса
+    assert [name for name in _type_tags if not hasattr(types, name)] == []
+
+    root = types.Section()
+    root.add('a', types.Int(1))
+    root.add('l', types.Long(2))
+    root.add('name', types.Str('x y'))
+    root.add('on', types.Bool(True))
+    root.add('r', types.Float(0.5))
+    section = types.Section()
+    section.add('b', types.Int(3))
+    root.add('o', section)
+    expected = 'a:i=1;l:i64=2;name:t="x y";on:b=yes;r:r=0.5;o{b:i=3;}'
+    assert ''.join(iterminify_section(root, strip_options)) == expected
@@ -1,4 +1,6 @@
 import pytest
+import json
+import struct
 import tempfile
 import os.path
 from wt_tools import blk_unpack
@@ -102,3 +104,53 @@ class TestNewBlk:
                                                      blk_unpack.BLK.output_type['json'])
         assert result_data == expected_data, "Wrong output blkx"
 
+
+
+# текст прежнего кодировщика с подстановкой заполнителей
+@pytest.mark.parametrize('kwargs, expected', [
+    (dict(indent=2, separators=(',', ': ')),
+     '{\n  "b": [\n    1,\n    2.5,\n    null,\n    true,\n    {}\n  ],\n'
+     '  "a": {\n    "s": "строка \\"q\\"",\n    "n": Infinity\n  },\n  "c": [],\n'
+     '  "pos": [1.0,-2.5e-05,3.0],\n  "m": [\n    [0,1],\n    [2,3]\n  ]\n}'),
+    (dict(separators=(',', ':')),
+     '{"b":[1,2.5,null,true,{}],"a":{"s":"строка \\"q\\"","n":Infinity},"c":[],'
+     '"pos":[1.0,-2.5e-05,3.0],"m":[[0,1],[2,3]]}'),
+    (dict(indent=2, separators=(',', ': '), sort_keys=True),
+     '{\n  "a": {\n    "n": Infinity,\n    "s": "строка \\"q\\""\n  },\n'
+     '  "b": [\n    1,\n    2.5,\n    null,\n    true,\n    {}\n  ],\n  "c": [],\n'
+     '  "m": [\n    [0,1],\n    [2,3]\n  ],\n  "pos": [1.0,-2.5e-05,3.0]\n}'),
+])
+def test_no_indent_encoder(kwargs, expected):
+    data = {'b': [1, 2.5, None, True, {}], 'a': {'s': 'строка "q"', 'n': float('inf')}, 'c': []}
+    encoder = blk_unpack.NoIndentEncoder(**kwargs)
+    assert encoder.encode(data) == json.dumps(data, ensure_ascii=False, **kwargs)
+
+    data['pos'] = blk_unpack.NoIndent([1.0, -2.5e-05, 3.0])
+    data['m'] = [blk_unpack.NoIndent([0, 1]), blk_unpack.NoIndent([2, 3])]
+    assert encoder.encode(data) == expected
+
+
+def test_get_block_value():
+    floats = [float(i) for i in range(12)]
+    blk = blk_unpack.BLK(struct.pack('HBB12f', 1, 1, 0xb, *floats))
+    assert blk.get_block_id_w_type(0) == (1, 0xb)
+    assert blk.get_block_value(0, 0xb) == ([floats[i:i + 3] for i in range(0, 12, 3)], 0x34)
+    assert blk.get_block_value(0, 0x5) == ([0.0, 1.0, 2.0], 0x10)
+    assert blk.get_block_value(0, 0x4) == ((0.0, 1.0), 0xc)
+    assert blk.get_block_value(0, 0x9) == (1, 0x4)
+    with pytest.raises(TypeError):
+        blk.get_block_value(0, 0xd)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_unpack_dir(tmp_path, jobs):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'empty.blk').write_bytes(b'')
+    (tmp_path / 'sub' / 'text.blk').write_text('a:i=1\n')
+    (tmp_path / 'sub' / 'broken.blk').write_bytes(b'\x01\x02')
+    (tmp_path / 'other.bin').write_bytes(b'\x01\x02')
+    errors = blk_unpack.unpack_dir(tmp_path, blk_unpack.BLK.output_type['json'], False, jobs)
+    assert [os.path.basename(filename) for filename, _ in errors] == ['broken.blk']
+    assert (tmp_path / 'empty.blkx').read_bytes() == b''
+    assert (tmp_path / 'sub' / 'text.blkx').read_text() == 'a:i=1\n'
+    assert not (tmp_path / 'other.binx').exists()
@@ -0,0 +1,30 @@
+from pathlib import Path
+import pytest
+
+pytest.importorskip('blk.binary')
+
+import wt_tools.blk_unpack_ng as ng  # noqa: E402
+
+
+def test_load_names_once(tmp_path: Path, monkeypatch):
+    calls = []
+
+    def compose_names_data(istream):
+        calls.append(istream.name)
+        return ['name']
+
+    monkeypatch.setattr(ng.bin, 'compose_names_data', compose_names_data)
+    monkeypatch.setattr(ng, '_nm_paths', {})
+    monkeypatch.setattr(ng, '_names_cache', {})
+
+    (tmp_path / 'nm').write_bytes(b'')
+    sub_path = tmp_path / 'a' / 'b'
+    sub_path.mkdir(parents=True)
+    for i in range(10):
+        file_path = sub_path / f'{i}.blk'
+        nm_path = ng.names_path(file_path, 'nm')
+        assert nm_path == tmp_path / 'nm'
+        assert ng.load_names(nm_path) == ['name']
+    assert len(calls) == 1
+    assert ng.dir_names_path(tmp_path / 'a', 'nm') == tmp_path / 'nm'
+    assert ng.dir_names_path(sub_path, 'missing') is None
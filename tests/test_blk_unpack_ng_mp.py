@@ -0,0 +1,40 @@
+from pathlib import Path
+import pytest
+
+pytest.importorskip('blk.binary')
+pytest.importorskip('multiprocessing_logging')
+
+import wt_tools.blk_unpack_ng_mp as ng_mp  # noqa: E402
+
+
+def test_collect_tasks(tmp_path: Path, monkeypatch):
+    def compose_names_data(istream):
+        if istream.read() == b'broken':
+            raise ng_mp.bin.ComposeError('broken')
+        return []
+
+    monkeypatch.setattr(ng_mp.bin, 'compose_names_data', compose_names_data)
+
+    slim_path = tmp_path / 'slim'
+    (slim_path / 'sub').mkdir(parents=True)
+    (slim_path / 'nm').write_bytes(b'')
+    (slim_path / 'sub' / 'big.blk').write_bytes(b'\x00' * 8)
+    (slim_path / 'small.blk').write_bytes(b'\x00')
+    broken_path = tmp_path / 'broken'
+    broken_path.mkdir()
+    (broken_path / 'nm').write_bytes(b'broken')
+    (broken_path / 'a.blk').write_bytes(b'\x00' * 2)
+    (tmp_path / 'text.blk').write_bytes(b'a:i=1\n\n')
+    (tmp_path / 'text.blkx').write_bytes(b'')
+
+    tasks = ng_mp.collect_tasks(tmp_path, ng_mp.jsn.JSON, False)
+    assert [(task.file_path, task.nm_path) for task in tasks] == [
+        (slim_path / 'sub' / 'big.blk', slim_path / 'nm'),
+        (tmp_path / 'text.blk', None),
+        (broken_path / 'a.blk', broken_path / 'nm'),
+        (slim_path / 'small.blk', slim_path / 'nm'),
+    ]
+
+    # таблица имен разбирается только в процессе-исполнителе
+    path, error = ng_mp._process_task(tasks[2])
+    assert path == broken_path / 'a.blk' and error.startswith(f'NameMap {broken_path / "nm"}: ComposeError')
@@ -0,0 +1,76 @@
+import io
+import json
+from pathlib import Path
+import sqlite3
+import zstandard
+from wt_tools.ddsx_index import scan, scan_vromfs_file, write_csv, write_jsonl, write_sqlite
+from wt_tools.formats.vromfs_image import VromfsImage
+from helpers.ddsx import make_ddsx, make_dxp
+from helpers.vromfs import build_image, ZSTD_PACKED
+
+body = bytes(range(16))
+zstd_ddsx = make_ddsx(body, 0x20, zstandard.ZstdCompressor().compress(body), w=8, h=4, levels=2)
+dxt5_ddsx = make_ddsx(body, 0x00, d3d_format=b'DXT5', w=1024, h=512)
+dxp = make_dxp([('tank_body*', zstd_ddsx), ('tank_track', dxt5_ddsx)])
+
+
+def test_scan(tmp_path: Path):
+    res_path = tmp_path / 'res'
+    res_path.mkdir()
+    (res_path / 'a.ddsx').write_bytes(zstd_ddsx)
+    (res_path / 'tanks.dxp.bin').write_bytes(dxp)
+    (res_path / 'broken.ddsx').write_bytes(b'DDSx')
+    (res_path / 'other.bin').write_bytes(b'')
+    image_path = tmp_path / 'tex.vromfs.bin'
+    image_path.write_bytes(build_image([('/b.ddsx', dxt5_ddsx), ('planes.dxp.bin', dxp), ('nm', b'')],
+                                       ZSTD_PACKED))
+
+    errors = []
+    records = list(scan([str(res_path), str(image_path)], errors))
+    assert [(Path(record.source).name, record.name) for record in records] == [
+        ('a.ddsx', ''),
+        ('tanks.dxp.bin', 'tank_body.ddsx'),
+        ('tanks.dxp.bin', 'tank_track.ddsx'),
+        ('tex.vromfs.bin', 'b.ddsx'),
+        ('tex.vromfs.bin', 'planes.dxp.bin/tank_body.ddsx'),
+        ('tex.vromfs.bin', 'planes.dxp.bin/tank_track.ddsx'),
+    ]
+    assert [Path(path).name for path, _ in errors] == ['broken.ddsx']
+
+    record = records[1]
+    assert (record.format, record.width, record.height, record.levels, record.codec, record.mem_size) == \
+        ('DXT1', 8, 4, 2, 'zstd', 16)
+    assert (records[3].format, records[3].codec, records[3].width) == ('DXT5', 'not_packed', 1024)
+
+    ostream = io.StringIO()
+    assert write_csv(records, ostream) == 6
+    assert ostream.getvalue().splitlines()[0] == \
+        'source,name,format,width,height,depth,levels,codec,mem_size,packed_size,flags'
+
+    ostream = io.StringIO()
+    write_jsonl(records, ostream)
+    assert json.loads(ostream.getvalue().splitlines()[2])['name'] == 'tank_track.ddsx'
+
+    db_path = tmp_path / 'textures.db'
+    assert write_sqlite(iter(records), db_path, batch_size=4) == 6
+    db = sqlite3.connect(str(db_path))
+    assert db.execute("SELECT count(*) FROM textures WHERE format = 'DXT5'").fetchone() == (3,)
+    db.close()
+
+
+def test_scan_vromfs_file_lazy(tmp_path: Path, monkeypatch):
+    image_path = tmp_path / 'tex.vromfs.bin'
+    big = bytes(range(256)) * 4096
+    image_path.write_bytes(build_image([('a.ddsx', zstd_ddsx), ('big.bin', big), ('nm', b'')], ZSTD_PACKED))
+
+    # без кэша тело распаковывается только до последней текстуры
+    ends = []
+    fill = VromfsImage._fill
+
+    def spy_fill(self, end: int):
+        ends.append(end)
+        fill(self, end)
+
+    monkeypatch.setattr(VromfsImage, '_fill', spy_fill)
+    assert [record.name for record in scan_vromfs_file(str(image_path))] == ['a.ddsx']
+    assert ends and max(ends) < len(big)
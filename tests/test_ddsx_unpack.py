@@ -0,0 +1,45 @@
+from pathlib import Path
+import struct
+import zlib
+import pytest
+import pylzma
+import zstandard
+from wt_tools.ddsx_unpack import unpack, unpack_dir
+from helpers.ddsx import make_ddsx, FLG_REV_MIP_ORDER
+
+body = bytes(range(8)) * 2
+textures = {
+    'plain.ddsx': make_ddsx(body[:8], 0x00),
+    'zstd.ddsx': make_ddsx(body[:8], 0x20, zstandard.ZstdCompressor().compress(body[:8])),
+    'lzma.ddsx': make_ddsx(body[:8], 0x40, pylzma.compress(body[:8])),
+    'zlib.ddsx': make_ddsx(body[:8], 0x80, zlib.compress(body[:8])),
+    # 2x2 и 1x1 уровни по 8 байт, от меньшего к большему
+    'mips.ddsx': make_ddsx(body, 0x20, zstandard.ZstdCompressor().compress(body), FLG_REV_MIP_ORDER, 2, 2, 2),
+    'dxt3.ddsx': make_ddsx(body[:8], 0x00).replace(b'DXT1', b'DXT3', 1),
+    'empty.ddsx': b'',
+    'broken_zlib.ddsx': make_ddsx(body[:8], 0x80, b'not zlib data'),
+    'broken_lzma.ddsx': make_ddsx(body[:8], 0x40, b'\x5d\x00\x00\x01\x00not lzma data'),
+    'broken_zstd.ddsx': make_ddsx(body[:8], 0x20, b'not zstd data'),
+}
+
+
+def test_unpack():
+    dds = unpack(textures['zstd.ddsx'])
+    assert dds[:4] == b'DDS ' and len(dds) == 0x80 + 8
+    assert dds[0x80:] == body[:8]
+    assert struct.unpack_from('<III', dds, 0xc) == (4, 4, 8)
+    assert unpack(textures['mips.ddsx'])[0x80:] == body[8:] + body[:8]
+    assert unpack(textures['dxt3.ddsx']) is None
+    assert unpack(textures['broken_zlib.ddsx']) is None
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_unpack_dir(tmp_path: Path, jobs: int):
+    (tmp_path / 'sub').mkdir()
+    for name, data in textures.items():
+        (tmp_path / 'sub' / name).write_bytes(data)
+    errors = unpack_dir(tmp_path, jobs, quiet=True)
+    assert [Path(filename).name for filename, _ in errors] == [
+        'broken_lzma.ddsx', 'broken_zlib.ddsx', 'broken_zstd.ddsx', 'dxt3.ddsx', 'empty.ddsx']
+    for name in ('plain', 'zstd', 'lzma', 'zlib'):
+        assert (tmp_path / 'sub' / (name + '.dds')).read_bytes()[0x80:] == body[:8]
@@ -0,0 +1,27 @@
+import pytest
+from wt_tools.formats.sniff import is_text, sniff, BBF, BBZ, DDSX, DXP, EMPTY, FAT, SLIM, TEXT, VROMFS, WRPL
+
+
+@pytest.mark.parametrize(['bs', 'type_'], [
+    pytest.param(b'', EMPTY, id='empty'),
+    pytest.param(b'\x00BBF\x03\x00', BBF, id='bbf'),
+    pytest.param(b'\x00BBz\x10\x00', BBZ, id='bbz'),
+    pytest.param(b'DDSxDXT1', DDSX, id='ddsx'),
+    pytest.param(b'DxP2\x01\x00', DXP, id='dxp'),
+    pytest.param(b'\xe5\xac\x00\x10\x00', WRPL, id='wrpl'),
+    pytest.param(b'VRFs\x00\x00PC\x00', VROMFS, id='vromfs'),
+    pytest.param(b'VRFx\x00\x00PC\x00', VROMFS, id='vromfs_ext'),
+    pytest.param(b'\x00\x01\x02', SLIM, id='slim'),
+    pytest.param(b'\x01\x02name\x00', FAT, id='fat'),
+    pytest.param('a:t="абв"\r\n\tb{}\x1a'.encode(), TEXT, id='text'),
+    pytest.param(memoryview(b'x:i=1'), TEXT, id='memoryview'),
+])
+def test_sniff(bs, type_):
+    assert sniff(bs) == type_
+
+
+def test_is_text():
+    assert is_text(b'')
+    assert is_text(bytes(range(0x1a, 0x100)) + b'\t\n\r')
+    for b in b'\x00\x01\x08\x0b\x0c\x0e\x19':
+        assert not is_text(b'text' + bytes([b]))
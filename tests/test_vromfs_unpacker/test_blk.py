@@ -0,0 +1,27 @@
+from pathlib import Path
+import pytest
+from helpers.vromfs import build_image, ZSTD_PACKED
+
+pytest.importorskip('blk.binary')
+
+from wt_tools.vromfs_blk_unpacker import unpack  # noqa: E402
+
+files = (
+    ('/version', b'2.9.0.1'),
+    ('config/empty.blk', b''),
+    ('config/text.blk', b'a:i=1\n'),
+    ('config/broken.blk', b'\x01\x00\x01'),
+)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_unpack(tmp_path: Path, jobs: int):
+    image_path = tmp_path / 'char.vromfs.bin'
+    image_path.write_bytes(build_image(files, ZSTD_PACKED))
+    dst_path = tmp_path / 'out'
+    blks_count, errors = unpack(image_path, dst_path, jobs=jobs, quiet=True)
+    assert blks_count == 3
+    assert [name for name, _ in errors] == ['config/broken.blk']
+    assert (dst_path / 'config/empty.blkx').read_bytes() == b''
+    assert (dst_path / 'config/text.blkx').read_bytes() == b'a:i=1\n'
+    assert not (dst_path / 'version').exists()
@@ -0,0 +1,82 @@
+from pathlib import Path
+import pytest
+from wt_tools.vromfs_fs import VromfsFS, LRUCache
+from helpers.vromfs import build_image, fat_zstd, names_map, ZSTD_PACKED
+
+high_files = (
+    ('gamedata/units/tankmodels/fr_b1_ter.blk', fat_zstd(b'\x00' * 64)),
+    ('config/settings.blk', b'\x01' + b'override'),
+    ('nm', names_map(b'\x03abc')),
+)
+
+low_files = (
+    ('/version', b'2.9.0.1'),
+    ('gamedata/units/tankmodels/us_m1.blk', b'\x01' + b'm1'),
+    ('config/settings.blk', b'\x01' + b'settings'),
+)
+
+
+@pytest.fixture()
+def fs(tmp_path: Path) -> VromfsFS:
+    high_path = tmp_path / 'high.vromfs.bin'
+    high_path.write_bytes(build_image(high_files, ZSTD_PACKED))
+    low_path = tmp_path / 'low.vromfs.bin'
+    low_path.write_bytes(build_image(low_files))
+    with VromfsFS([high_path, low_path], cache_size=100) as fs:
+        yield fs
+
+
+def test_read(fs: VromfsFS):
+    assert fs.read_bytes('config/settings.blk') == b'override'
+    assert fs.image_of('config/settings.blk').endswith('high.vromfs.bin')
+    assert fs.read_bytes('version') == b'2.9.0.1'
+    with fs.open('/gamedata/units/tankmodels/fr_b1_ter.blk') as f:
+        assert f.read() == b'\x00' * 64
+    with fs.open('version', 'r') as f:
+        assert f.read() == '2.9.0.1'
+    with pytest.raises(FileNotFoundError):
+        fs.read_bytes('missing.blk')
+    with pytest.raises(IsADirectoryError):
+        fs.read_bytes('gamedata')
+
+
+def test_listdir(fs: VromfsFS):
+    assert fs.listdir() == ['config', 'gamedata', 'nm', 'version']
+    assert fs.listdir('gamedata/units/tankmodels') == ['fr_b1_ter.blk', 'us_m1.blk']
+    assert fs.is_dir('gamedata/units') and fs.is_file('nm') and not fs.exists('sounds')
+    with pytest.raises(NotADirectoryError):
+        fs.listdir('version')
+
+
+def test_glob(fs: VromfsFS):
+    assert fs.glob('**/*.blk') == [
+        'config/settings.blk', 'gamedata/units/tankmodels/fr_b1_ter.blk', 'gamedata/units/tankmodels/us_m1.blk']
+    assert fs.glob('gamedata/*/tankmodels/fr_*.blk') == ['gamedata/units/tankmodels/fr_b1_ter.blk']
+    assert fs.glob('*.blk') == []
+    assert fs.glob('ver?ion') == ['version']
+
+
+def test_stat(fs: VromfsFS):
+    st = fs.stat('gamedata/units/tankmodels/fr_b1_ter.blk')
+    assert st.st_size == 64
+    assert st.packed_size == len(high_files[0][1])
+    assert fs.stat('version').st_size == 7
+
+
+def test_cache(fs: VromfsFS):
+    assert fs.read_bytes('nm') == b'\x03abc'
+    assert len(fs._cache) == 1
+    fs.read_bytes('gamedata/units/tankmodels/fr_b1_ter.blk')
+    assert fs._cache.size == 68
+
+
+def test_lru_cache():
+    cache = LRUCache(10)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    assert cache.get('a') == b'1234'
+    cache.put('c', b'1234')
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    cache.put('d', b'x' * 11)
+    assert 'd' not in cache
+    assert cache.size == 8
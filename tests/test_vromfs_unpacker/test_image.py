@@ -0,0 +1,240 @@
+from hashlib import blake2b, md5
+import json
+from pathlib import Path
+from click.testing import CliRunner
+import pytest
+import zstandard as zstd
+from wt_tools.formats.vromfs_image import IndexCache, VromfsImage, VromfsImageError, read_tables
+from wt_tools.formats.vromfs_parser import vromfs_file, DeobfsReader
+from wt_tools.vromfs_unpacker import decompress, files_list_info, main, read_file, remove_file, unpack
+from helpers import make_tmppath
+from helpers.vromfs import build_body, build_image, fat_zstd, names_map, obfuscate, NOT_PACKED, ZSTD_PACKED, \
+    ZSTD_PACKED_NOCHECK
+
+tmppath = make_tmppath(__name__)
+
+files = (
+    ('/version', b'2.9.0.1'),
+    ('gamedata/units/tankmodels/fr_b1_ter.blk', fat_zstd(b'\x00' * 64)),
+    ('gamedata/empty.bin', b''),
+    ('config/settings.blk', b'\x01' + b'settings' * 16),
+    ('nm', names_map(b'\x03abc')),
+)
+
+
+@pytest.fixture(scope='module', params=[
+    pytest.param((NOT_PACKED, b'VRFs'), id='not_packed'),
+    pytest.param((ZSTD_PACKED, b'VRFx'), id='zstd_packed'),
+    pytest.param((ZSTD_PACKED_NOCHECK, b'VRFs'), id='zstd_packed_nocheck'),
+])
+def image_path(request, tmppath: Path) -> Path:
+    packed_type, magic = request.param
+    path = tmppath / f'{packed_type}.vromfs.bin'
+    path.write_bytes(build_image(files, packed_type, magic))
+    return path
+
+
+def test_image_matches_parser(image_path: Path):
+    parsed = vromfs_file.parse(image_path.read_bytes())
+    names_ns = parsed.body.data.data.filename_table.filenames
+    data_ns = parsed.body.data.data.file_data_table.file_data_list
+
+    with VromfsImage(image_path) as image:
+        assert len(image) == len(names_ns)
+        assert image.md5 == parsed.md5
+        for entry, name_ns, data_ns in zip(image, names_ns, data_ns):
+            assert entry.filename == name_ns.filename
+            assert entry.file_data_size == data_ns.file_data_size
+            assert entry.data == data_ns.data
+
+
+def test_unpack(image_path: Path, tmp_path: Path):
+    written_names = unpack(image_path, tmp_path)
+    assert written_names == ('version', 'gamedata/units/tankmodels/fr_b1_ter.blk', 'config/settings.blk', 'nm')
+    assert (tmp_path / 'version').read_bytes() == b'2.9.0.1'
+    assert (tmp_path / 'gamedata/units/tankmodels/fr_b1_ter.blk').read_bytes() == b'\x00' * 64
+    assert (tmp_path / 'config/settings.blk').read_bytes() == b'settings' * 16
+    assert (tmp_path / 'nm').read_bytes() == b'\x03abc'
+
+
+def test_read_tables():
+    many_files = [(f'gamedata/{i}.blk', bytes([i % 256]) * (i % 7)) for i in range(5000)]
+    many_files.append(('nm', b''))
+    body = build_body(many_files)
+    names, records = read_tables(b'head' + body, 4)
+    assert names == [name for name, _ in many_files]
+    assert [body[offset:offset + size] for offset, size in records] == [data for _, data in many_files]
+
+    with pytest.raises(VromfsImageError):
+        read_tables(body[:0x20 + len(many_files) * 8 + 100])
+
+
+def test_find(image_path: Path):
+    with VromfsImage(image_path) as image:
+        assert image.find('version').filename == '/version'
+        assert image.find('gamedata/units/tankmodels/fr_b1_ter.blk').index == 1
+        assert image.find('gamedata/units/tankmodels/missing.blk') is None
+
+
+def test_read_file(image_path: Path):
+    assert read_file(image_path, 'gamedata/units/tankmodels/fr_b1_ter.blk') == b'\x00' * 64
+    assert read_file(image_path, 'nm') == b'\x03abc'
+    with pytest.raises(KeyError):
+        read_file(image_path, 'missing')
+
+
+def test_cat_command(image_path: Path):
+    result = CliRunner().invoke(main, ['cat', str(image_path), 'config/settings.blk'])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == b'settings' * 16
+
+
+def test_unpack_file_list(image_path: Path, tmp_path: Path):
+    file_list_path = tmp_path / 'file_list.json'
+    file_list_path.write_text('["nm", "missing", "/version"]')
+    dst_path = tmp_path / 'out'
+    written_names = unpack(image_path, dst_path, file_list_path)
+    assert written_names == ('version', 'nm')
+
+
+def test_unpack_jobs(image_path: Path, tmp_path: Path):
+    written_names = unpack(image_path, tmp_path, jobs=4)
+    assert written_names == ('version', 'gamedata/units/tankmodels/fr_b1_ter.blk', 'config/settings.blk', 'nm')
+    assert (tmp_path / 'gamedata/units/tankmodels/fr_b1_ter.blk').read_bytes() == b'\x00' * 64
+
+
+def test_unpack_batch(tmp_path: Path):
+    src_path = tmp_path / 'game'
+    (src_path / 'sub').mkdir(parents=True)
+    for rel_path, packed_type in ('char.vromfs.bin', ZSTD_PACKED), ('sub/aces.vromfs.bin', NOT_PACKED):
+        (src_path / rel_path).write_bytes(build_image(files, packed_type))
+
+    dst_path = tmp_path / 'out'
+    result = CliRunner().invoke(main, [str(src_path), '-O', str(dst_path), '-p', '2'])
+    assert result.exit_code == 0, result.output
+    assert '2 of 2 images, 8 files' in result.output
+    for rel_path in 'char.vromfs.bin', 'sub/aces.vromfs.bin':
+        assert (dst_path / rel_path / 'config/settings.blk').read_bytes() == b'settings' * 16
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_files_list_info(image_path: Path, jobs: int):
+    filelist = [{'filename': name, 'hash': md5(data).hexdigest()} for name, data in files]
+    expected = json.dumps({'version': 1, 'filelist': filelist})
+    assert files_list_info(image_path, jobs=jobs) == expected
+
+    lines = files_list_info(image_path, hash_name='blake2b', jobs=jobs, jsonl=True).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'filename': name, 'hash': blake2b(data).hexdigest()} for name, data in files]
+
+
+def test_lazy_tables(tmp_path: Path):
+    image_path = tmp_path / 'char.vromfs.bin'
+    image_path.write_bytes(build_image(files, ZSTD_PACKED))
+    with VromfsImage(image_path) as image:
+        assert image.names == [name for name, _ in files]
+        filled = image._filled
+        assert 0 < filled < image.header.original_size
+        assert image.find('version').data == b'2.9.0.1'
+        assert filled < image._filled < image.header.original_size
+        assert image.find('nm').data == names_map(b'\x03abc')
+
+
+def test_index_cache(tmp_path: Path):
+    image_path = tmp_path / 'char.vromfs.bin'
+    image_path.write_bytes(build_image(files, ZSTD_PACKED))
+    cache_path = tmp_path / 'cache'
+    metadata = files_list_info(image_path)
+
+    with VromfsImage(image_path, IndexCache(cache_path)) as image:
+        assert image._reader is None
+    assert len(list(cache_path.iterdir())) == 1
+
+    with VromfsImage(image_path, IndexCache(cache_path)) as image:
+        assert image.names == [name for name, _ in files]
+        assert image._filled == 0
+        assert image.find('version').data == b'2.9.0.1'
+        assert 0 < image._filled < image.header.original_size
+    assert files_list_info(image_path, index_cache=cache_path) == metadata
+    assert read_file(image_path, 'config/settings.blk', cache_path) == b'settings' * 16
+
+    result = CliRunner().invoke(main, ['ls', str(image_path), '--index_cache', str(cache_path)])
+    assert result.exit_code == 0
+    assert result.output.split() == [name for name, _ in files]
+
+    # the image is changed, the record is stale
+    image_path.write_bytes(build_image(files[:2], ZSTD_PACKED))
+    with VromfsImage(image_path, IndexCache(cache_path)) as image:
+        assert image.names == ['/version', 'gamedata/units/tankmodels/fr_b1_ter.blk']
+
+
+def test_unpack_incremental(tmp_path: Path):
+    image_path = tmp_path / 'char.vromfs.bin'
+    dst_path = tmp_path / 'out'
+    image_path.write_bytes(build_image(files))
+    assert len(unpack(image_path, dst_path, incremental=True)) == 4
+    assert unpack(image_path, dst_path, incremental=True) == ()
+
+    changed_files = (
+        ('/version', b'2.9.0.2'),
+        ('config/settings.blk', b'\x01' + b'settings' * 16),
+        ('gamedata/new.bin', b'new'),
+        ('nm', names_map(b'\x03abc')),
+    )
+    image_path.write_bytes(build_image(changed_files))
+    assert unpack(image_path, dst_path, incremental=True) == ('version', 'gamedata/new.bin')
+    assert (dst_path / 'version').read_bytes() == b'2.9.0.2'
+    assert not (dst_path / 'gamedata/units').exists()
+
+    (dst_path / 'config/settings.blk').unlink()
+    assert unpack(image_path, dst_path, incremental=True) == ('config/settings.blk',)
+
+    # другой словарь: все файлы пишутся заново, исчезнувшие удаляются
+    def dict_files(dict_id: bytes, *extra_files):
+        return (
+            ('/version', b'2.9.0.3'),
+            *extra_files,
+            (dict_id.hex() + '.dict', b'dictionary' * 8 + dict_id),
+            ('nm', names_map(b'\x03abc', dict_id)),
+        )
+
+    image_path.write_bytes(build_image(dict_files(b'\x01' * 32, ('gone.txt', b'gone'))))
+    assert unpack(image_path, dst_path, incremental=True) == ('version', 'gone.txt', '01' * 32 + '.dict', 'nm')
+    assert not (dst_path / 'gamedata').exists()
+
+    image_path.write_bytes(build_image(dict_files(b'\x02' * 32)))
+    assert unpack(image_path, dst_path, incremental=True) == ('version', '02' * 32 + '.dict', 'nm')
+    assert sorted(path.name for path in dst_path.iterdir()) == ['02' * 32 + '.dict', 'nm', 'version']
+
+
+def test_remove_file(tmp_path: Path):
+    dst_path = tmp_path / 'out'
+    (dst_path / 'a/b').mkdir(parents=True)
+    (dst_path / 'a/b/c.bin').write_bytes(b'c')
+    remove_file(dst_path, 'a/b/c.bin')
+    assert dst_path.is_dir() and not (dst_path / 'a').exists()
+
+    # соседняя директория с тем же префиксом не трогается
+    (tmp_path / 'out2').mkdir()
+    remove_file(dst_path, '../out2/missing.bin')
+    assert (tmp_path / 'out2').is_dir()
+
+
+@pytest.mark.parametrize('size', [0, 10, 1 << 20, 6_000_000])
+@pytest.mark.parametrize('write_content_size', [True, False])
+def test_decompress(size: int, write_content_size: bool):
+    data = bytes(range(256)) * (size // 256) + b'x' * (size % 256)
+    frame = zstd.ZstdCompressor(write_content_size=write_content_size).compress(data)
+    dctx = zstd.ZstdDecompressor()
+    assert decompress(dctx, frame) == data
+    assert decompress(dctx, memoryview(b'\x00' + frame)[1:]) == data
+
+
+@pytest.mark.parametrize('size', [0, 15, 16, 17, 31, 32, 33, 34, 35, 36, 100, 4099])
+def test_deobfs_reader(size: int):
+    data = bytes(range(256)) * (size // 256 + 1)
+    data = data[:size]
+    image = b'head' + obfuscate(data) + b'tail'
+    with DeobfsReader(image, 4, size) as reader:
+        chunks = iter(lambda: reader.read(7), b'')
+        assert b''.join(chunks) == data